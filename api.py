@@ -1,103 +1,204 @@
-import fitz  # PyMuPDF
+import os
 import json
-import re
-from collections import Counter
-import io
+import time
+import uuid
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from round_1a_parser import extract_outline, map_file
 
 try:
     from flask import Flask, request, jsonify
 except ImportError:
     raise ImportError("Flask is not installed. Please install it with 'pip install flask'.")
 
-app = Flask(__name__)
+# Processes that run extractions; 0 means one per CPU.
+API_WORKERS = int(os.environ.get("API_WORKERS", "0")) or os.cpu_count() or 1
+# Extractions queued or running before new uploads are turned away with 503.
+API_QUEUE_LIMIT = int(os.environ.get("API_QUEUE_LIMIT", str(4 * API_WORKERS)))
+# Seconds a request waits for its extraction before answering 504.
+API_TIMEOUT = float(os.environ.get("API_TIMEOUT", "60"))
+# Uploads above this size are copied to a temp file that the worker memory-maps.
+API_SPOOL_BYTES = int(float(os.environ.get("API_SPOOL_MB", "8")) * 1024 * 1024)
+# Largest accepted request body.
+API_MAX_UPLOAD_BYTES = int(float(os.environ.get("API_MAX_UPLOAD_MB", "256")) * 1024 * 1024)
+# Outline results kept in memory, keyed by the SHA-1 of the PDF.
+API_RESULT_CACHE = int(os.environ.get("API_RESULT_CACHE", "1024"))
+# Files submitted as async jobs and not yet extracted before POST /jobs answers 503.
+API_JOB_QUEUE_LIMIT = int(os.environ.get("API_JOB_QUEUE_LIMIT", "1024"))
+# Finished jobs kept for status and result requests.
+API_JOB_HISTORY = int(os.environ.get("API_JOB_HISTORY", "256"))
 
-def get_font_statistics(doc):
-    font_counts = Counter()
-    size_counts = Counter()
-
-    for page in doc:
-        blocks = page.get_text("dict")["blocks"]
-        for b in blocks:
-            if b['type'] == 0:
-                for l in b["lines"]:
-                    for s in l["spans"]:
-                        font_counts[s['font']] += 1
-                        size_counts[round(s['size'])] += 1
-
-    body_size = size_counts.most_common(1)[0][0] if size_counts else 12
-    potential_heading_sizes = sorted([size for size in size_counts if size > body_size], reverse=True)
-
-    heading_levels = {}
-    if len(potential_heading_sizes) > 0:
-        heading_levels[potential_heading_sizes[0]] = "H1"
-    if len(potential_heading_sizes) > 1:
-        heading_levels[potential_heading_sizes[1]] = "H2"
-    if len(potential_heading_sizes) > 2:
-        heading_levels[potential_heading_sizes[2]] = "H3"
-        
-    return body_size, heading_levels
+app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = API_MAX_UPLOAD_BYTES
 
-def is_bold(font_name):
-    return any(x in font_name.lower() for x in ['bold', 'black', 'heavy'])
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(API_QUEUE_LIMIT)
+_job_slots = threading.BoundedSemaphore(API_JOB_QUEUE_LIMIT)
+# sha1 -> result, least recently used first; sha1 -> future of a running extraction
+_results = OrderedDict()
+_inflight = {}
+# Reentrant: cancelling a future under it runs its done callbacks, which take it too
+_results_lock = threading.RLock()
+# job id -> [(filename, sha1, future)], oldest first
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
 
 def extract_outline_from_stream(pdf_stream):
-    doc = fitz.open(stream=pdf_stream, filetype="pdf")
-    if doc.page_count == 0:
-        return {"title": "", "outline": []}
+    return extract_outline(pdf_stream)
 
-    body_size, heading_levels = get_font_statistics(doc)
-    
-    outline = []
-    potential_title = ""
-    max_title_size = 0
-    current_heading = {"text": "", "level": None, "page": 0}
-
-    def commit_current_heading():
-        if current_heading["text"]:
-            clean_text = re.sub(r'^\d+(\.\d+)*\s*', '', current_heading["text"]).strip()
-            outline.append({
-                "level": current_heading["level"],
-                "text": clean_text,
-                "page": current_heading["page"]
-            })
-            current_heading["text"] = ""
-            current_heading["level"] = None
-
-    for page_num, page in enumerate(doc, 0):
-        blocks = page.get_text("dict")["blocks"]
-        for b in blocks:
-            if b['type'] == 0:
-                for l in b["lines"]:
-                    if len(l['spans']) == 0 or len(l['spans'][0]['text'].strip()) < 3:
-                        continue
-                    
-                    span = l['spans'][0]
-                    text = span['text'].strip()
-                    size = round(span['size'])
-                    font = span['font']
-
-                    if page_num <= 1 and size > max_title_size:
-                        max_title_size = size
-                        potential_title = text
-
-                    level = heading_levels.get(size)
-                    
-                    if level and (is_bold(font) or size > body_size + 2):
-                        commit_current_heading()
-                        current_heading["text"] = text
-                        current_heading["level"] = level
-                        current_heading["page"] = page_num
-                    elif level and current_heading["level"] == level:
-                        current_heading["text"] += " " + text
-                    else:
-                        commit_current_heading()
-
-    commit_current_heading()
+def extract_outline_from_path(pdf_path):
+    # The worker reads the spooled file straight from the page cache
+    with map_file(pdf_path) as data:
+        return extract_outline(data)
 
-    return {
-        "title": potential_title,
-        "outline": outline
-    }
+def get_executor(broken=None):
+    """
+    The shared worker pool. Passing the executor a submit failed on with
+    BrokenProcessPool replaces it, once however many requests saw it break;
+    its queued extractions are cancelled.
+    """
+    global _executor
+    with _executor_lock:
+        if broken is not None and _executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=API_WORKERS)
+        return _executor
+
+def _submit(extract, payload):
+    executor = get_executor()
+    try:
+        return executor.submit(extract, payload)
+    except BrokenProcessPool:
+        # A worker died and took the pool with it; retry once on a new pool
+        return get_executor(executor).submit(extract, payload)
+
+def _upload_size(file):
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def read_upload(file, spool_threshold=None):
+    """
+    Returns (sha1, payload) for an uploaded file. The payload is the bytes,
+    or for uploads above spool_threshold (API_SPOOL_BYTES by default) the
+    path of a temp file the upload was copied to in chunks.
+    """
+    if spool_threshold is None:
+        spool_threshold = API_SPOOL_BYTES
+    digest = hashlib.sha1()
+    if _upload_size(file) <= spool_threshold:
+        data = file.read()
+        digest.update(data)
+        return digest.hexdigest(), data
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+        for chunk in iter(lambda: file.stream.read(1024 * 1024), b""):
+            digest.update(chunk)
+            spool.write(chunk)
+    return digest.hexdigest(), spool.name
+
+def _remove_spool(payload):
+    if isinstance(payload, str):
+        try:
+            os.remove(payload)
+        except OSError:
+            pass
+
+def submit_extraction(digest, payload, release=None):
+    """
+    Returns a future for the outline of the PDF with this sha1. A cached
+    result is returned at once and an identical PDF already being extracted
+    is shared; otherwise payload (bytes or a spooled path, which is deleted
+    afterwards) goes to the worker pool. release() is called when done, and
+    only if a future is returned: if this raises, the caller still holds
+    whatever release() would have given back.
+    A caller that stops waiting for the future calls abandon_extraction().
+    """
+    owner = False
+    with _results_lock:
+        result = _results.get(digest)
+        if result is not None:
+            _results.move_to_end(digest)
+            future = Future()
+            future.set_result(result)
+        elif digest in _inflight:
+            entry = _inflight[digest]
+            entry[1] += 1
+            future = entry[0]
+        else:
+            extract = extract_outline_from_path if isinstance(payload, str) else extract_outline_from_stream
+            try:
+                future = _submit(extract, payload)
+            except Exception:
+                _remove_spool(payload)
+                raise
+            # [future, number of requests and jobs waiting for it]
+            _inflight[digest] = [future, 1]
+            owner = True
+    if not owner:
+        _remove_spool(payload)
+
+    def finished(done):
+        if owner:
+            with _results_lock:
+                del _inflight[digest]
+                if not done.cancelled() and done.exception() is None:
+                    _results[digest] = done.result()
+                    while len(_results) > API_RESULT_CACHE:
+                        _results.popitem(last=False)
+            _remove_spool(payload)
+        # A slot is held until the worker is done, not until the request gives up
+        if release is not None:
+            release()
+    future.add_done_callback(finished)
+    return future
+
+def abandon_extraction(digest, future):
+    """
+    Called by a request that gave up waiting for a future from
+    submit_extraction. The extraction is cancelled, if it has not started
+    yet, only when no other request or job is still waiting for it.
+    """
+    with _results_lock:
+        entry = _inflight.get(digest)
+        if entry is None or entry[0] is not future:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            # Under the lock so nobody joins in between; finished() re-enters it
+            future.cancel()
+
+def _file_result(filename, digest, future, timeout=None):
+    entry = {"filename": filename, "sha1": digest}
+    try:
+        entry.update(future.result(timeout=timeout))
+    except FutureTimeoutError:
+        entry["error"] = "Extraction did not finish in time"
+    except CancelledError:
+        entry["status"] = "cancelled"
+        entry["error"] = "Extraction was cancelled"
+    except Exception as e:
+        entry["error"] = f"An error occurred during processing: {str(e)}"
+    return entry
+
+def _pdf_files():
+    """All uploaded files of the request, or an error message if any is not a PDF."""
+    files = [f for name in request.files for f in request.files.getlist(name)]
+    if not files:
+        return None, "No files in the request"
+    if any(f.filename == '' or not f.filename.lower().endswith('.pdf') for f in files):
+        return None, "Every file must be a PDF"
+    return files, None
 
 @app.route('/extract-outline', methods=['POST'])
 def handle_extract_outline():
@@ -109,13 +210,162 @@ def handle_extract_outline():
     if file.filename == '' or not file.filename.lower().endswith('.pdf'):
         return jsonify({"error": "No selected file or file is not a PDF"}), 400
     
+    if not _slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many extractions in progress, retry later"})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+    # The slot goes back when the extraction is done, or here if it never started
+    handed_off = False
     try:
-        pdf_stream = io.BytesIO(file.read())
-        result = extract_outline_from_stream(pdf_stream)
+        digest, payload = read_upload(file)
+        future = submit_extraction(digest, payload, _slots.release)
+        handed_off = True
+        try:
+            result = future.result(timeout=API_TIMEOUT)
+        except FutureTimeoutError:
+            # A running extraction finishes in the background
+            abandon_extraction(digest, future)
+            return jsonify({"error": f"Extraction did not finish within {API_TIMEOUT:g} seconds"}), 504
+        except CancelledError:
+            response = jsonify({"error": "Extraction was cancelled, retry later"})
+            response.headers["Retry-After"] = "1"
+            return response, 503
         return jsonify(result)
         
     except Exception as e:
         return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
+    finally:
+        if not handed_off:
+            _slots.release()
+
+@app.route('/extract-outline/batch', methods=['POST'])
+def handle_extract_outline_batch():
+    """Extracts every uploaded PDF in parallel; results come back in upload order."""
+    files, error = _pdf_files()
+    if error:
+        return jsonify({"error": error}), 400
+    deadline = time.monotonic() + API_TIMEOUT
+    pending = []
+    for file in files:
+        # Waits for free slots instead of failing, so a batch streams through the pool
+        if not _slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            pending.append({"filename": file.filename, "error": "Too many extractions in progress, retry later"})
+            continue
+        try:
+            digest, payload = read_upload(file)
+            future = submit_extraction(digest, payload, _slots.release)
+        except Exception as e:
+            _slots.release()
+            pending.append({"filename": file.filename, "error": f"An error occurred during processing: {str(e)}"})
+            continue
+        pending.append((file.filename, digest, future))
+    results = []
+    for entry in pending:
+        if isinstance(entry, tuple):
+            _, digest, future = entry
+            entry = _file_result(*entry, timeout=max(0.0, deadline - time.monotonic()))
+            if not future.done():
+                abandon_extraction(digest, future)
+        results.append(entry)
+    return jsonify({"results": results})
+
+def _job_status(files):
+    done = [future for _, _, future in files if future.done()]
+    cancelled = sum(1 for future in done if future.cancelled())
+    failed = sum(1 for future in done if not future.cancelled() and future.exception() is not None)
+    if len(done) == len(files):
+        status = "done"
+    elif any(future.running() or future.done() for _, _, future in files):
+        status = "running"
+    else:
+        status = "queued"
+    return {
+        "status": status, "files": len(files), "completed": len(done) - failed - cancelled,
+        "failed": failed, "cancelled": cancelled,
+    }
+
+@app.route('/jobs', methods=['POST'])
+def handle_submit_job():
+    """
+    Queues the uploaded PDFs as one asynchronous job and answers 202 with
+    its id. Every file is spooled to disk, so queued jobs do not hold
+    uploads in memory.
+    """
+    files, error = _pdf_files()
+    if error:
+        return jsonify({"error": error}), 400
+    acquired = 0
+    while acquired < len(files) and _job_slots.acquire(blocking=False):
+        acquired += 1
+    if acquired < len(files):
+        for _ in range(acquired):
+            _job_slots.release()
+        response = jsonify({"error": "Too many queued job files, retry later"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    job = []
+    for i, file in enumerate(files):
+        try:
+            digest, payload = read_upload(file, spool_threshold=0)
+            future = submit_extraction(digest, payload, _job_slots.release)
+        except Exception as e:
+            for _ in range(len(files) - i):
+                _job_slots.release()
+            return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
+        job.append((file.filename, digest, future))
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = job
+        # Forget the oldest finished jobs beyond the history limit
+        for old_id in list(_jobs):
+            if len(_jobs) <= API_JOB_HISTORY:
+                break
+            if old_id != job_id and all(future.done() for _, _, future in _jobs[old_id]):
+                del _jobs[old_id]
+    return jsonify({"job_id": job_id, "status_url": f"/jobs/{job_id}", "result_url": f"/jobs/{job_id}/result", **_job_status(job)}), 202
+
+def _get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def handle_job_status(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify({"job_id": job_id, **_job_status(job)})
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def handle_job_result(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    status = _job_status(job)
+    if status["status"] != "done":
+        return jsonify({"job_id": job_id, **status}), 202
+    return jsonify({"job_id": job_id, **status, "results": [_file_result(*entry) for entry in job]})
+
+@app.errorhandler(413)
+def handle_too_large(e):
+    return jsonify({"error": f"Upload larger than {API_MAX_UPLOAD_BYTES // (1024 * 1024)} MB"}), 413
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="PDF outline extraction service.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--production", action="store_true", help="serve without the debug server (waitress if installed)")
+    args = parser.parse_args()
+    if not args.production:
+        app.run(host=args.host, port=args.port, debug=True)
+    else:
+        get_executor()
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+        if serve is not None:
+            # Enough request threads to fill the queue; waiting requests cost a thread each
+            serve(app, host=args.host, port=args.port, threads=API_QUEUE_LIMIT + 4)
+        else:
+            print("waitress is not installed; using the threaded Werkzeug server")
+            app.run(host=args.host, port=args.port, threaded=True, debug=False, use_reloader=False)
\ No newline at end of file
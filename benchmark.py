@@ -0,0 +1,235 @@
+import os
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+import numpy as np
+import fitz  # PyMuPDF
+from round_1a_parser import extract_spans, get_font_statistics, sample_font_statistics, extract_outline_and_text, get_section_text
+import main
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 50
+# Embedding size of all-MiniLM-L12-v2, used for stand-in vectors when encoding is skipped
+EMBEDDING_DIM = 384
+
+# Font layouts for the synthetic corpus: (fontname, fontsize) per line role.
+# "flat" headings are bold at body size, so the parser falls back to one section per page.
+LAYOUTS = {
+    "sized": {"category": ("hebo", 16), "recipe": ("hebo", 16), "label": ("helv", 11), "body": ("helv", 11)},
+    "tiered": {"category": ("hebo", 20), "recipe": ("hebo", 15), "label": ("hebo", 13), "body": ("helv", 11)},
+    "flat": {"category": ("hebo", 11), "recipe": ("hebo", 11), "label": ("hebo", 11), "body": ("helv", 11)},
+}
+
+ADJECTIVES = ["Vegetarian", "Roasted", "Spicy", "Creamy", "Gluten-Free", "Grilled", "Vegan", "Classic", "Quick", "Baked"]
+DISHES = ["Lasagna", "Falafel", "Ratatouille", "Hummus", "Quinoa Salad", "Curry", "Frittata", "Tacos", "Risotto", "Stir-Fry"]
+INGREDIENTS = ["chickpeas", "tomatoes", "garlic", "olive oil", "spinach", "rice", "tofu", "onions", "bell peppers", "cheese", "eggs", "lentils"]
+STEPS = ["Preheat the oven and prepare a baking dish", "Chop the vegetables into small pieces", "Simmer gently for 20 minutes",
+         "Season with salt, pepper and fresh herbs", "Serve warm with a side salad", "Mix everything in a large bowl"]
+
+def _recipe_lines(rng, body_lines):
+    lines = [("recipe", f"{rng.choice(ADJECTIVES)} {rng.choice(DISHES)}"), ("label", "Ingredients:")]
+    for _ in range(max(1, body_lines // 2)):
+        lines.append(("body", f"• {rng.randint(1, 4)} cups {rng.choice(INGREDIENTS)} - chopped"))
+    lines.append(("label", "Instructions:"))
+    for step in range(max(1, body_lines - body_lines // 2)):
+        lines.append(("body", f"{step + 1}. {rng.choice(STEPS)}."))
+    return lines
+
+def generate_recipe_pdf(path, pages=4, heading_density=3, layout="tiered", seed=0):
+    """
+    Writes a recipe-style PDF: each page starts with a category heading and
+    holds heading_density recipes, each a title, an ingredient list and
+    numbered instructions sized to fill the page.
+    """
+    rng = random.Random(seed)
+    fonts = LAYOUTS[layout]
+    line_height = fonts["body"][1] * 1.4
+    lines_per_page = int((PAGE_HEIGHT - 2 * MARGIN) / line_height)
+    body_lines = max(2, (lines_per_page - 1) // max(1, heading_density) - 3)
+    with fitz.open() as doc:
+        for page_num in range(pages):
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            lines = [("category", f"{rng.choice(['Breakfast', 'Lunch', 'Dinner', 'Sides'])} Ideas {page_num + 1}")]
+            for _ in range(heading_density):
+                lines.extend(_recipe_lines(rng, body_lines))
+            y = MARGIN
+            for role, text in lines:
+                fontname, fontsize = fonts[role]
+                y += fontsize * 1.4
+                if y > PAGE_HEIGHT - MARGIN:
+                    break
+                page.insert_text((MARGIN, y), text, fontname=fontname, fontsize=fontsize)
+        doc.save(path)
+    return path
+
+def generate_corpus(out_dir, documents=9, pages=4, heading_density=3, layout="tiered", seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    return [
+        generate_recipe_pdf(os.path.join(out_dir, f"synthetic_{i + 1:03d}.pdf"), pages, heading_density, layout, seed + i)
+        for i in range(documents)
+    ]
+
+def time_stage(fn, repeat):
+    """Runs fn repeat times; returns its last result and the timing summary in seconds."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return result, {
+        "runs": repeat,
+        "min_s": round(min(durations), 6),
+        "median_s": round(statistics.median(durations), 6),
+        "mean_s": round(statistics.mean(durations), 6),
+    }
+
+def _with_items(timing, items, unit):
+    timing["items"] = items
+    timing["unit"] = unit
+    timing["items_per_s"] = round(items / timing["min_s"], 1) if timing["min_s"] > 0 else None
+    return timing
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def _page_count(path):
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+def run_benchmark(pdf_paths, repeat=3, encode=True, top_k=main.TOP_K):
+    """
+    Times each pipeline stage separately over pdf_paths, bypassing the parse
+    and embedding caches. Returns a JSON-serializable report.
+    """
+    stages = {}
+    config = main.scoring_config()
+
+    def decode():
+        spans = []
+        for path in pdf_paths:
+            with fitz.open(path) as doc:
+                spans.append(extract_spans(doc))
+        return spans
+    doc_spans, timing = time_stage(decode, repeat)
+    stages["span_decode"] = _with_items(timing, sum(len(s) for s in doc_spans), "spans")
+
+    _, timing = time_stage(lambda: [get_font_statistics(spans) for spans in doc_spans], repeat)
+    stages["font_statistics"] = _with_items(timing, sum(len(s) for s in doc_spans), "spans")
+
+    def sample_fonts():
+        stats = []
+        for path in pdf_paths:
+            with fitz.open(path) as doc:
+                stats.append(sample_font_statistics(doc))
+        return stats
+    sampled, timing = time_stage(sample_fonts, repeat)
+    # Decodes only the sampled pages; compare with span_decode plus font_statistics
+    stages["font_statistics_sampled"] = _with_items(timing, sum(info["pages_scanned"] for _, _, info in sampled), "pages")
+
+    analyses, timing = time_stage(lambda: [extract_outline_and_text(path) for path in pdf_paths], repeat)
+    raw_sections = [
+        (os.path.basename(path), section.get("text", ""), get_section_text(analysis, section), section.get("page", 1))
+        for path, analysis in zip(pdf_paths, analyses) for section in analysis["outline"]
+    ]
+    stages["outline_extraction"] = _with_items(timing, len(pdf_paths), "documents")
+
+    def clean():
+        return [
+            {"document": document, "section_title": main.clean_for_json(title), "text": main.clean_for_json(body), "page_number": page}
+            for document, title, body, page in raw_sections
+        ]
+    sections, timing = time_stage(clean, repeat)
+    stages["clean_for_json"] = _with_items(timing, sum(len(t) + len(b) for _, t, b, _ in raw_sections), "characters")
+
+    def score_keywords():
+        scorer = config.keyword_scorer
+        hits = scorer.match_sections(sections)
+        scorer.include_mask(hits)
+        return scorer.scores(hits, [s["document"] for s in sections])
+    kw_scores, timing = time_stage(score_keywords, repeat)
+    stages["keyword_scoring"] = _with_items(timing, len(sections), "sections")
+
+    texts = main.section_texts(sections)
+    query = config.query_builder.build("Prepare a vegetarian buffet-style dinner menu")
+    if encode and texts:
+        main.get_model()
+        (embeddings, query_embedding), timing = time_stage(lambda: (main.encode_texts(texts), main.encode_texts([query])), repeat)
+        stages["model_encode"] = _with_items(timing, len(texts) + 1, "texts")
+    else:
+        # Stand-in vectors so the top-K stage can still be timed without a model
+        rng = np.random.default_rng(0)
+        embeddings = rng.standard_normal((len(texts), EMBEDDING_DIM)).astype(np.float32)
+        query_embedding = rng.standard_normal((1, EMBEDDING_DIM)).astype(np.float32)
+
+    def select():
+        if not sections:
+            return []
+        section_index = main.index_sections(embeddings)
+        ids, semantic = main.semantic_candidates(section_index, query_embedding)[0]
+        scores = main.combine_scores(semantic, kw_scores[ids], config)
+        return main.select_top_sections([sections[i] for i in ids], scores, top_k)
+    _, timing = time_stage(select, repeat)
+    stages["top_k"] = _with_items(timing, len(sections), "sections")
+
+    return {
+        "corpus": {
+            "documents": len(pdf_paths),
+            "pages": sum(_page_count(path) for path in pdf_paths),
+            "spans": sum(len(s) for s in doc_spans),
+            "sections": len(sections),
+        },
+        "stages": stages,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on a synthetic (or existing) PDF corpus and emit JSON.")
+    parser.add_argument("--pdf-dir", help="benchmark the PDFs in this directory instead of a synthetic corpus")
+    parser.add_argument("--corpus-dir", help="where to write the synthetic corpus (default: a temporary directory)")
+    parser.add_argument("--documents", type=int, default=9)
+    parser.add_argument("--pages", type=int, default=4, help="pages per synthetic document")
+    parser.add_argument("--heading-density", type=int, default=3, help="recipes (headings) per page")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="tiered")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage; min, median and mean are reported")
+    parser.add_argument("--no-encode", action="store_true", help="skip model.encode (top-K then uses random vectors)")
+    parser.add_argument("--output", default="output/benchmark.json", help="where to write the JSON report")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.pdf_dir:
+            pdf_paths = sorted(os.path.join(args.pdf_dir, f) for f in os.listdir(args.pdf_dir) if f.lower().endswith(".pdf"))
+        else:
+            pdf_paths = generate_corpus(args.corpus_dir or tmp_dir, args.documents, args.pages, args.heading_density, args.layout, args.seed)
+        report = run_benchmark(pdf_paths, repeat=args.repeat, encode=not args.no_encode)
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "pdf_dir": args.pdf_dir,
+            "documents": args.documents,
+            "pages": args.pages,
+            "heading_density": args.heading_density,
+            "layout": args.layout,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "encode": not args.no_encode,
+            "embedding_backend": main.EMBEDDING_BACKEND,
+            "vector_index": main.VECTOR_INDEX,
+        },
+        **report,
+    }
+    if main.write_output(report, args.output):
+        for name, timing in report["stages"].items():
+            print(f"{name:<20} {timing['min_s']:>10.4f}s  {timing['items_per_s']} {timing['unit']}/s")
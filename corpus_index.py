@@ -0,0 +1,304 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import numpy as np
+from parse_cache import file_digest
+from vector_index import build_index, load_index
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+VECTORS_DIR = "vectors"
+
+class CorpusIndex:
+    """
+    Persistent, incrementally updated index of a document library: the
+    parsed sections of every document with their embeddings and keyword hit
+    matrices, ready to be ranked without parsing or encoding anything.
+
+    Every add writes a new segment directory (sections.json, embeddings.npy,
+    title_hits.npy, text_hits.npy) and then atomically replaces manifest.json,
+    which maps each document to the segment holding its current rows.
+    Replacing or removing a document only updates the manifest; the old rows
+    become dead and a segment is deleted once none of its rows are live.
+    compact() rewrites all live rows into one segment.
+
+    vector_index() builds a vector_backend index over the live embeddings
+    once per set of documents and saves it under vectors/, keyed by the
+    model, backend and document digests; later queries memory-map it.
+
+    Embeddings are only valid for model_id and hit matrices only for
+    keyword_signature; an index built for another model starts over empty,
+    and stale hit matrices are recomputed with rematch().
+    """
+
+    def __init__(self, path, model_id, keyword_signature, vector_backend="exact"):
+        self.path = path
+        self.model_id = model_id
+        self.keyword_signature = keyword_signature
+        self.vector_backend = vector_backend
+        self._manifest = None
+        self._loaded = None
+        # (fingerprint, index) of the last vector index loaded or built
+        self._vectors = None
+
+    def _manifest_path(self):
+        return os.path.join(self.path, MANIFEST_FILE)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, SEGMENTS_DIR, segment)
+
+    def _load_manifest(self):
+        if self._manifest is None:
+            try:
+                with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = None
+            if manifest is not None and manifest.get("model") != self.model_id:
+                print(f"Corpus index at {self.path} was built with {manifest.get('model')}; starting over")
+                manifest = None
+            self._manifest = manifest or {
+                "model": self.model_id, "keywords": self.keyword_signature, "documents": {}, "segments": {},
+            }
+        return self._manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self._manifest_path()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self._manifest_path())
+        self._loaded = None
+
+    def documents(self):
+        return sorted(self._load_manifest()["documents"])
+
+    def stale_keywords(self):
+        return self._load_manifest()["keywords"] != self.keyword_signature
+
+    def stats(self):
+        manifest = self._load_manifest()
+        live = sum(entry["sections"] for entry in manifest["documents"].values())
+        rows = sum(segment["rows"] for segment in manifest["segments"].values())
+        return {"documents": len(manifest["documents"]), "segments": len(manifest["segments"]), "live_sections": live, "dead_sections": rows - live}
+
+    def is_current(self, pdf_path):
+        """True if the indexed copy of pdf_path matches the file on disk."""
+        entry = self._load_manifest()["documents"].get(os.path.basename(pdf_path))
+        if entry is None:
+            return False
+        stat = os.stat(pdf_path)
+        if entry["size"] != stat.st_size:
+            return False
+        if entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        if entry["digest"] != file_digest(pdf_path).hex():
+            return False
+        # Same content under a new mtime: remember it to skip hashing next time
+        entry["mtime_ns"] = stat.st_mtime_ns
+        self._save_manifest()
+        return True
+
+    def _write_segment(self, sections, embeddings, hits):
+        segment = f"seg-{uuid.uuid4().hex}"
+        path = self._segment_path(segment)
+        os.makedirs(path)
+        title_hits, text_hits = hits
+        with open(os.path.join(path, "sections.json"), "w", encoding="utf-8") as f:
+            json.dump(sections, f, ensure_ascii=False)
+        np.save(os.path.join(path, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32))
+        np.save(os.path.join(path, "title_hits.npy"), np.asarray(title_hits, dtype=bool))
+        np.save(os.path.join(path, "text_hits.npy"), np.asarray(text_hits, dtype=bool))
+        return segment, {"rows": len(sections)}
+
+    def _drop_dead_segments(self):
+        manifest = self._manifest
+        used = {entry["segment"] for entry in manifest["documents"].values()}
+        for segment in [s for s in manifest["segments"] if s not in used]:
+            del manifest["segments"][segment]
+            shutil.rmtree(self._segment_path(segment), ignore_errors=True)
+
+    def add(self, pdf_path, build_fn):
+        """
+        Indexes pdf_path, replacing any earlier version of the same document.
+        build_fn(pdf_path) returns (sections, embeddings, (title_hits, text_hits)),
+        or None if the document failed to parse or has no sections.
+        Returns False without doing anything if the indexed copy is current,
+        and None if build_fn failed: nothing is indexed for the document (an
+        earlier version is dropped), so the next sync tries it again.
+        """
+        if self.is_current(pdf_path):
+            return False
+        manifest = self._load_manifest()
+        if manifest["keywords"] != self.keyword_signature and manifest["documents"]:
+            raise ValueError("Corpus index keyword hits are stale; call rematch() first")
+        manifest["keywords"] = self.keyword_signature
+        stat = os.stat(pdf_path)
+        digest = file_digest(pdf_path).hex()
+        built = build_fn(pdf_path)
+        if built is None:
+            if manifest["documents"].pop(os.path.basename(pdf_path), None) is not None:
+                self._drop_dead_segments()
+                self._save_manifest()
+            return None
+        sections, embeddings, hits = built
+        segment, info = self._write_segment(sections, embeddings, hits)
+        manifest["segments"][segment] = info
+        manifest["documents"][os.path.basename(pdf_path)] = {
+            "segment": segment, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest, "sections": len(sections),
+        }
+        self._drop_dead_segments()
+        self._save_manifest()
+        return True
+
+    def remove(self, name):
+        manifest = self._load_manifest()
+        if manifest["documents"].pop(name, None) is None:
+            return False
+        self._drop_dead_segments()
+        self._save_manifest()
+        return True
+
+    def sync(self, pdf_paths, build_fn, remove_missing=False):
+        """
+        Adds new and changed files; with remove_missing, also removes indexed
+        documents that are not among pdf_paths. Returns what changed; failed
+        documents are left out of the index.
+        """
+        changes = {"added": [], "replaced": [], "removed": [], "failed": [], "unchanged": 0}
+        for pdf_path in pdf_paths:
+            name = os.path.basename(pdf_path)
+            existed = name in self._load_manifest()["documents"]
+            added = self.add(pdf_path, build_fn)
+            if added is None:
+                changes["failed"].append(name)
+            elif added:
+                changes["replaced" if existed else "added"].append(name)
+            else:
+                changes["unchanged"] += 1
+        if remove_missing:
+            keep = {os.path.basename(pdf_path) for pdf_path in pdf_paths}
+            for name in self.documents():
+                if name not in keep and self.remove(name):
+                    changes["removed"].append(name)
+        return changes
+
+    def _read_segment(self, segment, mmap=True):
+        path = self._segment_path(segment)
+        with open(os.path.join(path, "sections.json"), "r", encoding="utf-8") as f:
+            sections = json.load(f)
+        embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        title_hits = np.load(os.path.join(path, "title_hits.npy"))
+        text_hits = np.load(os.path.join(path, "text_hits.npy"))
+        return sections, embeddings, title_hits, text_hits
+
+    def _live_rows(self, segment, sections):
+        documents = self._load_manifest()["documents"]
+        return [
+            i for i, section in enumerate(sections)
+            if documents.get(section["document"], {}).get("segment") == segment
+        ]
+
+    def load(self):
+        """
+        Returns (sections, embeddings, (title_hits, text_hits)) for all live
+        rows, ordered by document name and then by position in the document.
+        """
+        if self._loaded is not None:
+            return self._loaded
+        manifest = self._load_manifest()
+        if manifest["keywords"] != self.keyword_signature and manifest["documents"]:
+            raise ValueError("Corpus index keyword hits are stale; call rematch() first")
+        parts = []
+        for segment in manifest["segments"]:
+            sections, embeddings, title_hits, text_hits = self._read_segment(segment)
+            rows = self._live_rows(segment, sections)
+            if rows:
+                parts.append(([sections[i] for i in rows], embeddings[rows], title_hits[rows], text_hits[rows]))
+        if parts:
+            sections = [section for part in parts for section in part[0]]
+            # Stable, so each document keeps its own section order
+            order = sorted(range(len(sections)), key=lambda i: sections[i]["document"])
+            sections = [sections[i] for i in order]
+            embeddings, title_hits, text_hits = (np.concatenate([part[k] for part in parts])[order] for k in (1, 2, 3))
+        else:
+            sections = []
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+            title_hits = text_hits = np.zeros((0, 0), dtype=bool)
+        self._loaded = (sections, embeddings, (title_hits, text_hits))
+        return self._loaded
+
+    def _vector_fingerprint(self):
+        documents = self._load_manifest()["documents"]
+        rows = [(name, documents[name]["digest"], documents[name]["sections"]) for name in sorted(documents)]
+        return hashlib.sha1(json.dumps([self.model_id, self.vector_backend, rows]).encode("utf-8")).hexdigest()
+
+    def vector_index(self):
+        """
+        The vector index of load()'s embeddings, its ids being load() row
+        numbers. Memory-mapped from vectors/ if it was saved for the current
+        documents, otherwise built, saved and the older indexes deleted.
+        """
+        fingerprint = self._vector_fingerprint()
+        if self._vectors is not None and self._vectors[0] == fingerprint:
+            return self._vectors[1]
+        path = os.path.join(self.path, VECTORS_DIR, fingerprint)
+        try:
+            index = load_index(path)
+        except (OSError, ValueError, KeyError):
+            index = self._build_vector_index(path)
+        self._vectors = (fingerprint, index)
+        return index
+
+    def _build_vector_index(self, path):
+        _, embeddings, _ = self.load()
+        index = build_index(embeddings, self.vector_backend)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        index.save(tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process saved the same index first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        vectors_dir = os.path.dirname(path)
+        for name in os.listdir(vectors_dir):
+            if name != os.path.basename(path) and not name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(vectors_dir, name), ignore_errors=True)
+        return index
+
+    def compact(self):
+        """Rewrites all live rows into a single segment and deletes the rest."""
+        sections, embeddings, hits = self.load()
+        manifest = self._load_manifest()
+        old_segments = list(manifest["segments"])
+        if not sections:
+            manifest["segments"] = {}
+        else:
+            segment, info = self._write_segment(sections, embeddings, hits)
+            manifest["segments"] = {segment: info}
+            for entry in manifest["documents"].values():
+                entry["segment"] = segment
+        self._save_manifest()
+        for segment in old_segments:
+            shutil.rmtree(self._segment_path(segment), ignore_errors=True)
+        # Leftovers of interrupted writes are not referenced by the manifest
+        segments_dir = os.path.join(self.path, SEGMENTS_DIR)
+        if os.path.isdir(segments_dir):
+            for name in os.listdir(segments_dir):
+                if name not in manifest["segments"]:
+                    shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+        return self.stats()
+
+    def rematch(self, match_fn):
+        """Recomputes every segment's hit matrices with match_fn(sections) -> (title_hits, text_hits)."""
+        manifest = self._load_manifest()
+        for segment in manifest["segments"]:
+            path = self._segment_path(segment)
+            with open(os.path.join(path, "sections.json"), "r", encoding="utf-8") as f:
+                title_hits, text_hits = match_fn(json.load(f))
+            np.save(os.path.join(path, "title_hits.npy"), np.asarray(title_hits, dtype=bool))
+            np.save(os.path.join(path, "text_hits.npy"), np.asarray(text_hits, dtype=bool))
+        manifest["keywords"] = self.keyword_signature
+        self._save_manifest()
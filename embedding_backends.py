@@ -0,0 +1,124 @@
+import time
+import numpy as np
+
+class SentenceTransformerBackend:
+    """Full-precision SentenceTransformer encoding; the reference backend."""
+
+    name = "fp32"
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    def encode(self, texts, batch_size=32, convert_to_tensor=False, show_progress_bar=False):
+        return self.model.encode(
+            texts, batch_size=batch_size, convert_to_tensor=convert_to_tensor, show_progress_bar=show_progress_bar
+        )
+
+    def token_lengths(self, texts):
+        """Token count of each text as the model will see it, after truncation."""
+        input_ids = self.tokenizer(
+            texts, add_special_tokens=True, truncation=True, max_length=self.model.max_seq_length
+        )["input_ids"]
+        return [len(ids) for ids in input_ids]
+
+class DynamicInt8Backend(SentenceTransformerBackend):
+    """
+    The same model with every nn.Linear dynamically quantized to int8:
+    weights are stored as int8 and activations are quantized per batch, which
+    speeds up the transformer's matrix multiplies on CPU.
+    """
+
+    name = "int8"
+
+    def __init__(self, model):
+        import torch
+        model = model.to("cpu").eval()
+        super().__init__(torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+BACKENDS = {backend.name: backend for backend in (SentenceTransformerBackend, DynamicInt8Backend)}
+
+def create_backend(name, model):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](model)
+
+def plan_batches(lengths, token_budget, max_batch_size=256):
+    """
+    Groups text indices into batches, longest first, so that the padded size
+    of each batch (items x longest item) stays within token_budget. Short
+    texts end up in large batches instead of being padded to long ones.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches = []
+    batch = []
+    width = 0
+    for i in order:
+        if batch and ((len(batch) + 1) * width > token_budget or len(batch) >= max_batch_size):
+            batches.append(batch)
+            batch = []
+        if not batch:
+            width = max(lengths[i], 1)
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def encode_batched(backend, texts, token_budget=8192, max_batch_size=256, on_batch=None):
+    """
+    Encodes texts in token-budgeted, length-sorted batches. Identical texts
+    are encoded once. Rows of the result follow the order of texts.
+    on_batch(batch_size, padded_tokens, seconds) is called after each batch.
+    """
+    positions = {}
+    for text in texts:
+        positions.setdefault(text, len(positions))
+    unique_texts = list(positions)
+    embeddings = None
+    lengths = backend.token_lengths(unique_texts) if unique_texts else []
+    for batch in plan_batches(lengths, token_budget, max_batch_size):
+        start = time.perf_counter()
+        vectors = np.asarray(backend.encode([unique_texts[i] for i in batch], batch_size=len(batch)), dtype=np.float32)
+        if on_batch is not None:
+            # Batches are longest-first, so the first item sets the padded width
+            on_batch(len(batch), len(batch) * lengths[batch[0]], time.perf_counter() - start)
+        if embeddings is None:
+            embeddings = np.empty((len(unique_texts), vectors.shape[1]), dtype=np.float32)
+        embeddings[batch] = vectors
+    if embeddings is None:
+        return np.zeros((0, 0), dtype=np.float32)
+    return embeddings[[positions[text] for text in texts]]
+
+def ranking_drift(reference_rankings, candidate_rankings):
+    """
+    Compares two lists of top-K rankings (one list of item ids per query).
+    Returns the mean top-K overlap and the share of queries whose top-K is
+    identical in order, plus the share with the same top-1.
+    """
+    overlaps = []
+    identical = 0
+    same_first = 0
+    for reference, candidate in zip(reference_rankings, candidate_rankings):
+        k = max(len(reference), 1)
+        overlaps.append(len(set(reference) & set(candidate)) / k)
+        identical += list(reference) == list(candidate)
+        same_first += bool(reference) and bool(candidate) and reference[0] == candidate[0]
+    n = max(len(overlaps), 1)
+    return {
+        "queries": len(overlaps),
+        "mean_topk_overlap": float(np.mean(overlaps)) if overlaps else 1.0,
+        "identical_rankings": identical / n,
+        "same_top1": same_first / n,
+    }
+
+def embedding_drift(reference, candidate):
+    """Mean and minimum cosine similarity between matching rows of two embedding matrices."""
+    reference = np.asarray(reference, dtype=np.float32)
+    candidate = np.asarray(candidate, dtype=np.float32)
+    dots = np.sum(reference * candidate, axis=1)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    cosines = dots / np.maximum(norms, 1e-12)
+    return {"mean_cosine": float(cosines.mean()) if len(cosines) else 1.0, "min_cosine": float(cosines.min()) if len(cosines) else 1.0}
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import numpy as np
+
+INDEX_FILE = "index.json"
+
+def text_key(text):
+    """Hash of the whitespace-normalized text, used as the cache key."""
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+def _model_slug(model_name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+
+class EmbeddingCache:
+    """
+    Persistent store of section embeddings for one model.
+
+    Embeddings live in append-only float32 .npy shards (one per run that
+    encoded something new), opened memory-mapped on lookup. index.json maps
+    each text hash to (shard, row) and records per-shard size and last use;
+    once the store grows past max_bytes the least recently used shards are
+    deleted with their entries.
+
+    encode(defer=True) holds new embeddings in memory instead, for callers
+    that encode many small batches; they are written as one shard once
+    flush_rows are pending, and by flush().
+
+    One instance may be shared between threads: the index and pending
+    embeddings are only touched under a lock, which is not held while
+    encode_fn runs.
+    """
+
+    def __init__(self, cache_dir, model_name, max_bytes=512 * 1024 * 1024, flush_rows=16384):
+        self.path = os.path.join(cache_dir, _model_slug(model_name))
+        self.max_bytes = max_bytes
+        self.flush_rows = flush_rows
+        self._index = None
+        # key -> embedding encoded with defer=True and not stored yet
+        self._pending = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self._index_path(), "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {"shards": {}, "entries": {}}
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self._index_path()}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def lookup(self, keys):
+        """Returns {key: embedding} for the keys present in the cache."""
+        with self._lock:
+            index = self._load_index()
+            by_shard = {}
+            found = {}
+            for key in set(keys):
+                if key in self._pending:
+                    found[key] = self._pending[key]
+                    continue
+                entry = index["entries"].get(key)
+                if entry:
+                    by_shard.setdefault(entry[0], []).append((key, entry[1]))
+            now = time.time()
+            for shard, rows in by_shard.items():
+                try:
+                    matrix = np.load(os.path.join(self.path, shard), mmap_mode="r")
+                except (OSError, ValueError):
+                    continue
+                vectors = np.asarray(matrix[[row for _, row in rows]], dtype=np.float32)
+                for (key, _), vector in zip(rows, vectors):
+                    found[key] = vector
+                index["shards"][shard]["last_used"] = now
+            return found
+
+    def store(self, keys, embeddings):
+        """Writes a new shard for the given keys and evicts old shards if needed."""
+        if not keys:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        shard = f"shard-{uuid.uuid4().hex}.npy"
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        np.save(os.path.join(self.path, shard), matrix)
+        with self._lock:
+            index = self._load_index()
+            index["shards"][shard] = {"rows": len(keys), "bytes": matrix.nbytes, "last_used": time.time()}
+            for row, key in enumerate(keys):
+                index["entries"][key] = [shard, row]
+            self._evict(index)
+            self._save_index()
+
+    def flush(self):
+        """Stores the embeddings held back by encode(defer=True) as one shard."""
+        with self._lock:
+            if self._pending:
+                keys = list(self._pending)
+                embeddings = np.stack([self._pending[key] for key in keys])
+                self._pending = {}
+                self.store(keys, embeddings)
+            elif self._dirty:
+                self._save_index()
+            self._dirty = False
+
+    def _evict(self, index):
+        total = sum(info["bytes"] for info in index["shards"].values())
+        if total <= self.max_bytes:
+            return
+        evicted = set()
+        for shard, info in sorted(index["shards"].items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= info["bytes"]
+            evicted.add(shard)
+            try:
+                os.remove(os.path.join(self.path, shard))
+            except OSError:
+                pass
+        for shard in evicted:
+            del index["shards"][shard]
+        index["entries"] = {key: entry for key, entry in index["entries"].items() if entry[0] not in evicted}
+
+    def encode(self, texts, encode_fn, defer=False):
+        """
+        Returns an (n, dim) float32 matrix of embeddings for texts, calling
+        encode_fn only on texts that are not cached yet and storing the result.
+        With defer, new embeddings and last-use times are only written once
+        flush_rows are pending or on flush().
+        """
+        keys = [text_key(text) for text in texts]
+        found = self.lookup(keys)
+        missing_keys = []
+        missing_texts = []
+        for key, text in zip(keys, texts):
+            if key not in found:
+                found[key] = None
+                missing_keys.append(key)
+                missing_texts.append(text)
+        if missing_texts:
+            new_embeddings = np.asarray(encode_fn(missing_texts), dtype=np.float32)
+            for key, vector in zip(missing_keys, new_embeddings):
+                found[key] = vector
+            if defer:
+                with self._lock:
+                    self._pending.update(zip(missing_keys, new_embeddings))
+                    if len(self._pending) >= self.flush_rows:
+                        self.flush()
+            else:
+                self.store(missing_keys, new_embeddings)
+        elif found:
+            with self._lock:
+                if defer:
+                    self._dirty = True
+                else:
+                    self._save_index()
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
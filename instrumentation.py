@@ -0,0 +1,170 @@
+import os
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+PROFILERS = ("", "cprofile", "tracemalloc")
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Instrumentation:
+    """
+    Collects pipeline metrics for one run: wall time per stage, parse stats
+    per document, counters and embedding batch timings. Everything is kept
+    as plain numbers so it can be exported as JSON or Prometheus text.
+
+    With profile="cprofile" every stage also accumulates a cProfile whose
+    top functions are reported; with profile="tracemalloc" the peak Python
+    memory allocated inside each stage is reported. Nested stages are timed
+    but only the outermost one is profiled.
+    """
+
+    def __init__(self, profile="", max_batches=1000):
+        if profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profile}', expected one of {PROFILERS[1:]}")
+        self.profile = profile
+        self.max_batches = max_batches
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, profile=None):
+        with self._lock:
+            if profile is not None:
+                self.profile = profile
+            self.stages = {}
+            self.documents = {}
+            self.counters = {}
+            self.batches = deque(maxlen=self.max_batches)
+            self._profilers = {}
+            self._profiling = False
+
+    @contextmanager
+    def stage(self, name):
+        profiler = None
+        started_tracing = False
+        with self._lock:
+            profile = self.profile if not self._profiling else ""
+            self._profiling = self._profiling or bool(profile)
+        if profile == "cprofile":
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        elif profile == "tracemalloc":
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            peak = None
+            if profile == "tracemalloc":
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                if started_tracing:
+                    tracemalloc.stop()
+            with self._lock:
+                entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "max_seconds": 0.0})
+                entry["seconds"] += elapsed
+                entry["calls"] += 1
+                entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+                if peak is not None:
+                    entry["peak_memory_bytes"] = max(entry.get("peak_memory_bytes", 0), peak)
+                if profile:
+                    self._profiling = False
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_document(self, stats):
+        """stats: {"document", "parse_seconds", "pages", "spans", "sections", ...} for one parsed PDF."""
+        with self._lock:
+            self.documents[stats["document"]] = dict(stats)
+
+    def record_batch(self, texts, tokens, seconds):
+        """One model.encode call: batch size, padded token count and wall time."""
+        with self._lock:
+            self.batches.append({"texts": texts, "tokens": tokens, "seconds": seconds})
+
+    def _top_functions(self, profiler, limit=15):
+        stats = pstats.Stats(profiler).stats
+        rows = sorted(stats.items(), key=lambda item: -item[1][3])[:limit]
+        return [
+            {"function": f"{os.path.basename(filename)}:{line}({function})", "calls": calls, "cumulative_s": round(cumulative, 6)}
+            for (filename, line, function), (_, calls, _, cumulative, _) in rows
+        ]
+
+    def to_dict(self):
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+            documents = list(self.documents.values())
+            counters = dict(self.counters)
+            batches = list(self.batches)
+            profilers = dict(self._profilers)
+        for name, profiler in profilers.items():
+            stages[name]["top_functions"] = self._top_functions(profiler)
+        return {
+            "stages": stages,
+            "documents": documents,
+            "counters": counters,
+            "embedding_batches": {
+                "count": len(batches),
+                "texts": sum(b["texts"] for b in batches),
+                "seconds": sum(b["seconds"] for b in batches),
+                "max_seconds": max((b["seconds"] for b in batches), default=0.0),
+                "batches": batches,
+            },
+        }
+
+    def to_prometheus(self, prefix="document_analysis"):
+        """Renders the metrics in the Prometheus text exposition format."""
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, kind, samples, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_label(v)}"' for key, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text else f"{prefix}_{name} {value}")
+
+        stages = data["stages"]
+        metric("stage_seconds_total", "counter", [({"stage": n}, e["seconds"]) for n, e in stages.items()], "Wall time spent in each pipeline stage.")
+        metric("stage_calls_total", "counter", [({"stage": n}, e["calls"]) for n, e in stages.items()], "Times each pipeline stage ran.")
+        metric("stage_max_seconds", "gauge", [({"stage": n}, e["max_seconds"]) for n, e in stages.items()], "Slowest single run of each pipeline stage.")
+        memory = [({"stage": n}, e["peak_memory_bytes"]) for n, e in stages.items() if "peak_memory_bytes" in e]
+        if memory:
+            metric("stage_peak_memory_bytes", "gauge", memory, "Peak Python memory allocated inside each stage.")
+        for key, help_text in (
+            ("parse_seconds", "Time to parse each document."),
+            ("pages", "Pages in each document."),
+            ("spans", "Text spans decoded from each document."),
+            ("sections", "Sections produced from each document."),
+        ):
+            metric(f"document_{key}", "gauge", [({"document": d["document"]}, d.get(key, 0)) for d in data["documents"]], help_text)
+        for name, value in data["counters"].items():
+            metric(f"{name}_total", "counter", [({}, value)], f"Count of {name.replace('_', ' ')}.")
+        batches = data["embedding_batches"]
+        metric("embedding_batches_total", "counter", [({}, batches["count"])], "model.encode batches run.")
+        metric("embedding_texts_total", "counter", [({}, batches["texts"])], "Texts encoded by the model.")
+        metric("embedding_seconds_total", "counter", [({}, batches["seconds"])], "Wall time spent in model.encode.")
+        metric("embedding_batch_max_seconds", "gauge", [({}, batches["max_seconds"])], "Slowest model.encode batch.")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        # Scrapers such as the node exporter textfile collector must never see a partial file
+        os.replace(tmp_path, path)
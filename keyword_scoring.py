@@ -0,0 +1,160 @@
+import re
+import json
+import hashlib
+import numpy as np
+
+def _trie_pattern(keywords):
+    """Regex matching the longest keyword starting at the current position."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+    return build(trie)
+
+class KeywordMatcher:
+    """
+    Finds which keyword groups occur in a text, with the same substring
+    semantics as `any(keyword in text.lower() for keyword in group)`, in one
+    regex pass. The pattern is a keyword trie inside a lookahead, so every
+    position reports the longest keyword starting there; shorter keywords
+    contained in a found one are credited through a precomputed closure.
+    """
+
+    def __init__(self, groups):
+        self.names = [name for name, _ in groups]
+        keyword_groups = {}
+        for column, (_, keywords) in enumerate(groups):
+            for keyword in keywords:
+                if keyword:
+                    keyword_groups.setdefault(keyword.lower(), set()).add(column)
+        keywords = sorted(keyword_groups)
+        self._columns = {}
+        for keyword in keywords:
+            columns = set()
+            for other in keywords:
+                if other in keyword:
+                    columns |= keyword_groups[other]
+            self._columns[keyword] = sorted(columns)
+        self._pattern = re.compile("(?=(" + _trie_pattern(keywords) + "))") if keywords else None
+
+    def match(self, texts):
+        """Returns a (len(texts), len(groups)) boolean hit matrix."""
+        hits = np.zeros((len(texts), len(self.names)), dtype=bool)
+        if self._pattern is None:
+            return hits
+        findall = self._pattern.findall
+        columns = self._columns
+        rows = []
+        cols = []
+        for row, text in enumerate(texts):
+            if not text:
+                continue
+            for keyword in set(findall(text.lower())):
+                keyword_columns = columns[keyword]
+                rows.extend([row] * len(keyword_columns))
+                cols.extend(keyword_columns)
+        hits[rows, cols] = True
+        return hits
+
+class KeywordScorer:
+    """
+    Keyword filtering and scoring compiled once from the query_config tables.
+
+    Every section becomes one row of a sections x categories hit matrix
+    (query, boost and penalty categories, matched on the section text, plus
+    the query categories matched on the title). Exclusions, boosts and
+    penalties are then boolean reductions and dot products over that matrix.
+    """
+
+    def __init__(self, query_keywords, boost_words, penalty_words, document_preferences, scoring_weights):
+        groups = [(f"query:{name}", keywords) for name, keywords in query_keywords.items()]
+        groups += [(f"boost:{name}", config["keywords"]) for name, config in boost_words.items()]
+        groups += [(f"penalty:{name}", config["keywords"]) for name, config in penalty_words.items()]
+        self.matcher = KeywordMatcher(groups)
+        names = self.matcher.names
+        self.query_columns = np.array([i for i, name in enumerate(names) if name.startswith("query:")], dtype=np.intp)
+        self.boost_columns = np.array([names.index(f"boost:{name}") for name in boost_words], dtype=np.intp)
+        self.boost_scores = np.array([config["score"] for config in boost_words.values()], dtype=np.float64)
+        penalties = [name for name, config in penalty_words.items() if config["action"] == "penalty"]
+        self.penalty_columns = np.array([names.index(f"penalty:{name}") for name in penalties], dtype=np.intp)
+        self.penalty_scores = np.array([penalty_words[name]["score"] for name in penalties], dtype=np.float64)
+        self.exclude_columns = np.array([
+            names.index(f"penalty:{name}") for name, config in penalty_words.items() if config["action"] == "exclude"
+        ], dtype=np.intp)
+        self.weights = dict(scoring_weights)
+        # Category scores and document preferences are pre-multiplied by their weights
+        self.boost_weights = self.boost_scores * self.weights["keyword_boost"]
+        self.penalty_weights = self.penalty_scores * self.weights["penalty"]
+        self.document_preferences = [
+            (pattern.lower(), score * self.weights["document_preference"]) for pattern, score in document_preferences.items()
+        ]
+        self.title_matcher = KeywordMatcher([groups[i] for i in self.query_columns])
+        # Identifies the hit matrix layout; stored hit matrices are only valid under the same signature
+        self.signature = hashlib.sha1(json.dumps(groups).encode("utf-8")).hexdigest()
+
+    def match(self, titles, texts):
+        """Returns (title_hits, text_hits); title_hits only covers the query categories."""
+        return self.title_matcher.match(titles), self.matcher.match(texts)
+
+    def match_sections(self, sections):
+        return self.match([s['section_title'] for s in sections], [s['text'] for s in sections])
+
+    def include_mask(self, hits):
+        """Sections without excluded keywords that mention at least one query keyword."""
+        title_hits, text_hits = hits
+        excluded = text_hits[:, self.exclude_columns].any(axis=1)
+        relevant = title_hits.any(axis=1) | text_hits[:, self.query_columns].any(axis=1)
+        return relevant & ~excluded
+
+    def document_preference(self, document_name):
+        document_lower = document_name.lower()
+        for pattern, preference_score in self.document_preferences:
+            if pattern in document_lower:
+                return preference_score
+        return 0.0
+
+    def scores(self, hits, documents):
+        """Keyword relevance score per section: document preference + boosts + penalties."""
+        _, text_hits = hits
+        preferences = {}
+        for document in documents:
+            if document not in preferences:
+                preferences[document] = self.document_preference(document)
+        score = np.array([preferences[document] for document in documents], dtype=np.float64)
+        score += text_hits[:, self.boost_columns] @ self.boost_weights
+        score += text_hits[:, self.penalty_columns] @ self.penalty_weights
+        return score
+
+class QueryBuilder:
+    """
+    build_intelligent_query compiled from QUERY_TEMPLATES and QUERY_KEYWORDS.
+    One KeywordMatcher pass over the job finds the templates with any word
+    occurring in it; failing those, matching keyword categories contribute
+    their first three keywords.
+    """
+
+    def __init__(self, query_templates, query_keywords):
+        self.templates = list(query_templates.values())
+        self.template_matcher = KeywordMatcher([(name, template.lower().split()) for name, template in query_templates.items()])
+        self.keywords = list(query_keywords.values())
+        self.keyword_matcher = KeywordMatcher(list(query_keywords.items()))
+        # Built queries, and anything derived from them, are only valid under the same signature
+        self.signature = hashlib.sha1(json.dumps([query_templates, query_keywords]).encode("utf-8")).hexdigest()
+
+    def build(self, job):
+        hits = self.template_matcher.match([job])[0]
+        query_parts = [template for template, hit in zip(self.templates, hits) if hit]
+        if not query_parts:
+            hits = self.keyword_matcher.match([job])[0]
+            for keywords, hit in zip(self.keywords, hits):
+                if hit:
+                    query_parts.extend(keywords[:3])
+        return " ".join(query_parts)
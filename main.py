@@ -1,123 +1,119 @@
 import os
 import json
 import re
+import time
+import argparse
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from round_1a_parser import extract_outline_and_text
-from query_config import QUERY_KEYWORDS, BOOST_WORDS, PENALTY_WORDS, DOCUMENT_PREFERENCES, QUERY_TEMPLATES, SCORING_WEIGHTS
+from round_1a_parser import extract_document, get_section_text, map_file
+from embedding_cache import EmbeddingCache
+from embedding_backends import create_backend, encode_batched, ranking_drift, embedding_drift
+from parse_cache import ParseCache
+from text_normalizer import TextNormalizer
+from instrumentation import Instrumentation
+from vector_index import build_index
+from corpus_index import CorpusIndex
+from query_cache import QueryCache
+import query_config
+from scoring_config import ScoringConfigLoader
 
 PDF_DIR = "./input"
 INPUT_JSON_PATH = "input/challenge_input.json"
 TOP_K = 5
+# Most sections any one document may contribute to the top K; 0 means no cap.
+MAX_SECTIONS_PER_DOCUMENT = int(os.environ.get("MAX_SECTIONS_PER_DOCUMENT", "0"))
+MODEL_NAME = 'all-MiniLM-L12-v2'
+# Local model snapshot written by --save-model-snapshot: a directory (or a
+# torch-pickled .pt file) loaded without any Hugging Face hub resolution.
+MODEL_SNAPSHOT = os.environ.get("MODEL_SNAPSHOT", "")
+# Embedding backend: "fp32" (reference) or "int8" (dynamically quantized linear layers).
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "fp32")
+# Padded tokens (batch size x longest text) allowed per model.encode batch.
+ENCODE_TOKEN_BUDGET = int(os.environ.get("ENCODE_TOKEN_BUDGET", "8192"))
+# Semantic search backend: "exact" (dense dot product) or "ivf" (approximate).
+VECTOR_INDEX = os.environ.get("VECTOR_INDEX", "exact")
+# With an approximate index, only this many nearest sections are re-ranked by keywords.
+ANN_CANDIDATES = int(os.environ.get("ANN_CANDIDATES", "200"))
+# Section embeddings are cached on disk across runs; set to "" to disable.
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+EMBEDDING_CACHE_MAX_MB = int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512"))
+# Parsed outlines are cached per PDF; set to "" or PARSE_CACHE=0 to bypass.
+PARSE_CACHE_DIR = os.environ.get("PARSE_CACHE_DIR", ".cache/parsed")
+if os.environ.get("PARSE_CACHE", "1") == "0":
+    PARSE_CACHE_DIR = ""
+# Read PDFs through a read-only memory map shared by hashing and parsing; 0 uses plain file reads.
+PDF_MMAP = os.environ.get("PDF_MMAP", "1") == "1"
+# Sections per embedding micro-batch in --stream mode.
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "256"))
+# Processes used to parse PDFs; 0 means one per CPU, 1 parses in-process.
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "0")) or os.cpu_count() or 1
+# Persistent corpus index of sections, embeddings and keyword hits (--index-*, --from-index).
+CORPUS_INDEX_DIR = os.environ.get("CORPUS_INDEX_DIR", ".cache/corpus")
+# Built queries and their embeddings are kept per persona/job and persisted here; "" keeps them in memory only.
+QUERY_CACHE_DIR = os.environ.get("QUERY_CACHE_DIR", ".cache/queries")
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+# Scoring tables are compiled from this file and hot-reloaded when it changes,
+# checked at most every QUERY_CONFIG_CHECK_SECONDS; a negative value never reloads.
+QUERY_CONFIG_PATH = os.environ.get("QUERY_CONFIG_PATH", query_config.__file__)
+QUERY_CONFIG_CHECK_SECONDS = float(os.environ.get("QUERY_CONFIG_CHECK_SECONDS", "1"))
+# Add stage timings, per-document parse stats and counts to the output metadata.
+METRICS_IN_OUTPUT = os.environ.get("METRICS_IN_OUTPUT", "0") == "1"
+# Also write those metrics to this Prometheus text file; empty disables.
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+# Wrap every pipeline stage in "cprofile" or "tracemalloc"; empty disables.
+PROFILE_STAGES = os.environ.get("PROFILE_STAGES", "")
+
+# Compiled once: clean_text keeps control characters as whitespace, clean_for_json drops them and truncates
+TEXT_NORMALIZER = TextNormalizer(strip_control=False)
+JSON_NORMALIZER = TextNormalizer(max_length=2000)
+SCORING_CONFIG = ScoringConfigLoader(QUERY_CONFIG_PATH, QUERY_CONFIG_CHECK_SECONDS)
+METRICS = Instrumentation(PROFILE_STAGES)
 
 _model_cache = None
 _embedding_cache = {}
+_query_cache = {}
 
-def load_input_data():
-    with open(INPUT_JSON_PATH, "r", encoding="utf-8") as f:
-        input_data = json.load(f)
+def read_request(input_data):
     persona = input_data.get("persona", {}).get("role", "Unknown Persona")
     job = input_data.get("job_to_be_done", {}).get("task", "Unknown Task")
     filenames = [doc["filename"] for doc in input_data.get("documents", [])]
+    return persona, job, filenames
+
+def load_input_data():
+    with open(INPUT_JSON_PATH, "r", encoding="utf-8") as f:
+        input_data = json.load(f)
+    persona, job, filenames = read_request(input_data)
     return input_data, persona, job, filenames
 
+def scoring_config():
+    """
+    The current compiled query_config, reloaded if the file changed. Code
+    that uses the config for several steps should call this once and keep
+    the result, so a reload in between cannot mix two versions: the helpers
+    below take that snapshot as config and only call this without one.
+    """
+    return SCORING_CONFIG.current()
+
 def build_intelligent_query(persona, job):
-    job_lower = job.lower()
-    
-    query_parts = []
-    
-    for template_name, template_content in QUERY_TEMPLATES.items():
-        template_lower = template_content.lower()
-        if any(keyword in job_lower for keyword in template_lower.split()):
-            query_parts.append(template_content)
-    
-    if not query_parts:
-        job_words = job_lower.split()
-        for category, keywords in QUERY_KEYWORDS.items():
-            if any(keyword in job_lower for keyword in keywords):
-                query_parts.extend(keywords[:3])
-    
-    return " ".join(query_parts)
+    return scoring_config().query_builder.build(job)
 
 def should_include_section(section_title, text, job):
-    job_lower = job.lower()
-    title_lower = section_title.lower()
-    text_lower = text.lower()
-    
-    for category, config in PENALTY_WORDS.items():
-        if config["action"] == "exclude":
-            if any(keyword in text_lower for keyword in config["keywords"]):
-                return False
-    
-    relevant_keywords = []
-    for category, keywords in QUERY_KEYWORDS.items():
-        relevant_keywords.extend(keywords)
-    
-    if not any(keyword in title_lower or keyword in text_lower for keyword in relevant_keywords):
-        return False
-    
-    return True
+    scorer = scoring_config().keyword_scorer
+    hits = scorer.match([section_title], [text])
+    return bool(scorer.include_mask(hits)[0])
 
 def calculate_relevance_score(section_title, text, query, job, document_name):
-    title_lower = section_title.lower()
-    text_lower = text.lower()
-    job_lower = job.lower()
-    
-    score = 0.0
-    
-    for doc_pattern, preference_score in DOCUMENT_PREFERENCES.items():
-        if doc_pattern.lower() in document_name.lower():
-            score += preference_score * SCORING_WEIGHTS["document_preference"]
-            break
-    
-    for category, config in BOOST_WORDS.items():
-        if any(keyword in text_lower for keyword in config["keywords"]):
-            score += config["score"] * SCORING_WEIGHTS["keyword_boost"]
-    
-    for category, config in PENALTY_WORDS.items():
-        if config["action"] == "penalty":
-            if any(keyword in text_lower for keyword in config["keywords"]):
-                score += config["score"] * SCORING_WEIGHTS["penalty"]
-    
-    return score
+    scorer = scoring_config().keyword_scorer
+    hits = scorer.match([section_title], [text])
+    return float(scorer.scores(hits, [document_name])[0])
 
 def clean_text(text):
-    if not text:
-        return ""
-    
-    text = re.sub(r'[\uf0b7\u2022\u2023\u25e6\u2043\u2219]', '', text)
-    
-    text = ' '.join(text.split())
-    
-    text = re.sub(r'\d+\.\s*', '', text)
-    
-    text = re.sub(r'•\s*', '', text)
-    text = re.sub(r'-\s*', '', text)
-    text = re.sub(r'\*\s*', '', text)
-    
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+    return TEXT_NORMALIZER(text)
 
 def clean_for_json(text):
-    if not text:
-        return ""
-    
-    text = str(text)
-    
-    text = text.replace('\u0000', '')
-    text = text.replace('\u2028', ' ')
-    text = text.replace('\u2029', ' ')
-    
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
-    
-    text = clean_text(text)
-    
-    if len(text) > 2000:
-        text = text[:2000] + "..."
-    
-    return text
+    return JSON_NORMALIZER(text)
 
 def convert_to_json_serializable(obj):
     if isinstance(obj, np.integer):
@@ -133,79 +129,469 @@ def convert_to_json_serializable(obj):
     else:
         return obj
 
+def load_model(snapshot=MODEL_SNAPSHOT):
+    # torch and sentence_transformers take seconds to import, so they are only
+    # imported once something actually needs to be embedded
+    if snapshot:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        if os.path.isfile(snapshot):
+            import torch
+            return torch.load(snapshot, map_location="cpu", weights_only=False)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(snapshot or MODEL_NAME, device="cpu" if snapshot else None)
+
+def save_model_snapshot(path):
+    model = load_model()
+    if path.endswith(".pt"):
+        import torch
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        torch.save(model, path)
+    else:
+        model.save(path)
+    print(f"Model snapshot written to {path}")
+
 def get_model():
     global _model_cache
     if _model_cache is None:
-        _model_cache = SentenceTransformer('all-MiniLM-L12-v2')
+        _model_cache = create_backend(EMBEDDING_BACKEND, load_model())
     return _model_cache
 
-def process_sections_intelligently(all_sections, query, job):
-    model = get_model()
-    
-    filtered_sections = []
-    for section in all_sections:
-        if should_include_section(section['section_title'], section['text'], job):
-            filtered_sections.append(section)
+def encode_texts(texts):
+    return encode_batched(get_model(), texts, token_budget=ENCODE_TOKEN_BUDGET, on_batch=METRICS.record_batch)
+
+def embedding_model_id():
+    # Quantized backends produce different vectors, so they get their own stores
+    return MODEL_NAME if EMBEDDING_BACKEND == "fp32" else f"{MODEL_NAME}-{EMBEDDING_BACKEND}"
+
+def get_query_cache():
+    model_id = embedding_model_id()
+    if model_id not in _query_cache:
+        _query_cache[model_id] = QueryCache(QUERY_CACHE_DIR, model_id, QUERY_CACHE_SIZE)
+    return _query_cache[model_id]
+
+def query_artefacts(requests, config=None):
+    """
+    Returns (queries, query_embeddings) for a list of (persona, job) pairs.
+    Pairs seen before under the same query config and model come from the
+    query cache; the rest are built, encoded in one call and cached.
+    """
+    cache = get_query_cache()
+    builder = (config or scoring_config()).query_builder
+    keys = [QueryCache.key(persona, job, builder.signature) for persona, job in requests]
+    entries = {key: cache.get(key) for key in keys}
+    METRICS.count("query_cache_hits", sum(1 for key in keys if entries[key] is not None))
+    missing = {}
+    for key, (persona, job) in zip(keys, requests):
+        if entries[key] is None and key not in missing:
+            missing[key] = builder.build(job)
+    if missing:
+        METRICS.count("query_cache_misses", len(missing))
+        with METRICS.stage("encode_query"):
+            embeddings = encode_texts(list(missing.values()))
+        for (key, query), embedding in zip(missing.items(), embeddings):
+            cache.put(key, query, embedding)
+            # Not read back from the cache, which may be too small to hold it
+            entries[key] = (query, embedding)
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"Error saving query cache: {e}")
+    return [entries[key][0] for key in keys], np.array([entries[key][1] for key in keys])
+
+def get_embedding_cache():
+    if not EMBEDDING_CACHE_DIR:
+        return None
+    model_id = embedding_model_id()
+    if model_id not in _embedding_cache:
+        _embedding_cache[model_id] = EmbeddingCache(
+            EMBEDDING_CACHE_DIR, model_id, max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        )
+    return _embedding_cache[model_id]
+
+def encode_sections(section_texts, defer=False):
+    # The model is only loaded if some text is missing from the cache
+    cache = get_embedding_cache()
+    if cache is None:
+        return encode_texts(section_texts)
+    return cache.encode(section_texts, encode_texts, defer=defer)
+
+def flush_embedding_cache():
+    cache = get_embedding_cache()
+    if cache is not None:
+        cache.flush()
+
+def parse_document_with_stats(pdf_path, cache_dir=None):
+    """
+    Returns (sections, stats), stats being the document's parse time, page,
+    span and section counts and characters removed by text cleanup.
+    Parse errors are raised, for the caller to report and count.
+    """
+    start = time.perf_counter()
+    with map_file(pdf_path) if PDF_MMAP else nullcontext() as data:
+        if cache_dir:
+            doc_analysis = ParseCache(cache_dir).get_or_parse(pdf_path, extract_document, data)
+        else:
+            doc_analysis = extract_document(pdf_path if data is None else data)
+    sections = []
+    for section in doc_analysis['outline']:
+        # Each section is normalized exactly once, here; later stages reuse the clean text
+        title, title_removed = JSON_NORMALIZER.normalize(section.get("text", ""))
+        text, text_removed = JSON_NORMALIZER.normalize(get_section_text(doc_analysis, section))
+        sections.append({
+            "document": os.path.basename(pdf_path),
+            "section_title": title,
+            "text": text,
+            "page_number": section.get("page", 1),
+            "chars_removed": title_removed + text_removed,
+        })
+    stats = {
+        "document": os.path.basename(pdf_path),
+        "parse_seconds": time.perf_counter() - start,
+        "pages": doc_analysis.get("page_count", 0),
+        "spans": doc_analysis.get("span_count", 0),
+        "sections": len(sections),
+        "chars_removed": sum(section["chars_removed"] for section in sections),
+    }
+    return sections, stats
+
+def parse_document(pdf_path, cache_dir=None):
+    return parse_document_with_stats(pdf_path, cache_dir)[0]
+
+def iter_documents(pdf_paths, workers=PARSE_WORKERS, cache_dir=None):
+    """
+    Yields (pdf_path, sections) in the order given while a process pool parses
+    ahead, with at most two documents per worker in flight. A file that fails
+    to parse is reported and yields an empty list.
+    cache_dir defaults to PARSE_CACHE_DIR; pass "" to bypass the parse cache.
+    """
+    if cache_dir is None:
+        cache_dir = PARSE_CACHE_DIR
+    if workers <= 1 or len(pdf_paths) <= 1:
+        for pdf_path in pdf_paths:
+            print(f"Processing: {os.path.basename(pdf_path)}")
+            try:
+                sections, stats = parse_document_with_stats(pdf_path, cache_dir)
+                METRICS.record_document(stats)
+            except Exception as e:
+                print(f"Error processing {os.path.basename(pdf_path)}: {e}")
+                METRICS.count("parse_errors")
+                sections = []
+            yield pdf_path, sections
+        return
+    workers = min(workers, len(pdf_paths))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(pdf_paths)
+        pending = deque()
+        for pdf_path in remaining:
+            pending.append((pdf_path, executor.submit(parse_document_with_stats, pdf_path, cache_dir)))
+            if len(pending) == 2 * workers:
+                break
+        while pending:
+            pdf_path, future = pending.popleft()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(parse_document_with_stats, next_path, cache_dir)))
+            print(f"Processing: {os.path.basename(pdf_path)}")
+            try:
+                sections, stats = future.result()
+                METRICS.record_document(stats)
+            except Exception as e:
+                print(f"Error processing {os.path.basename(pdf_path)}: {e}")
+                METRICS.count("parse_errors")
+                sections = []
+            yield pdf_path, sections
+
+def parse_documents(pdf_paths, workers=PARSE_WORKERS, cache_dir=None):
+    """
+    Parses PDFs into section records across a process pool.
+    Returns one list of sections per path, in the order given.
+    """
+    return [sections for _, sections in iter_documents(pdf_paths, workers, cache_dir)]
+
+def _existing_paths(filenames, pdf_dir):
+    pdf_paths = [os.path.join(pdf_dir, file) for file in filenames]
+    return [pdf_path for pdf_path in pdf_paths if os.path.exists(pdf_path)]
+
+def load_sections(filenames, pdf_dir=PDF_DIR):
+    all_sections = []
+    for sections in parse_documents(_existing_paths(filenames, pdf_dir)):
+        all_sections.extend(sections)
+    removed = sum(section.get("chars_removed", 0) for section in all_sections)
+    print(f"Text cleanup removed {removed} characters from {len(all_sections)} sections")
+    return all_sections
+
+def filter_sections(all_sections, job, config=None):
+    scorer = (config or scoring_config()).keyword_scorer
+    with METRICS.stage("filter"):
+        include = scorer.include_mask(scorer.match_sections(all_sections))
+        filtered_sections = [section for section, keep in zip(all_sections, include) if keep]
+    METRICS.count("sections_parsed", len(all_sections))
+    METRICS.count("sections_filtered_out", len(all_sections) - len(filtered_sections))
     
     if not filtered_sections:
         print("Warning: No sections passed the intelligent filter. Using all sections.")
         filtered_sections = all_sections
-    
-    section_texts = [f"{s['section_title']} {s['text']}" for s in filtered_sections]
-    
-    section_embeddings = model.encode(section_texts, convert_to_tensor=False, show_progress_bar=False)
-    query_embedding = model.encode([query], convert_to_tensor=False, show_progress_bar=False)[0]
-    
-    semantic_scores = cosine_similarity([query_embedding], section_embeddings)[0]
-    
-    combined_scores = []
-    for i, section in enumerate(filtered_sections):
-        semantic_score = float(semantic_scores[i]) * SCORING_WEIGHTS["semantic_similarity"]
-        intelligent_score = calculate_relevance_score(
-            section['section_title'], 
-            section['text'], 
-            query, 
-            job,
-            section['document']
+    return filtered_sections
+
+def section_texts(sections):
+    return [f"{s['section_title']} {s['text']}" for s in sections]
+
+def embed_sections(sections, defer=False):
+    return encode_sections(section_texts(sections), defer)
+
+def keyword_scores(sections, query, job, config=None):
+    scorer = (config or scoring_config()).keyword_scorer
+    hits = scorer.match_sections(sections)
+    return scorer.scores(hits, [s['document'] for s in sections])
+
+def combine_scores(semantic_scores, section_keyword_scores, config=None):
+    scores = np.asarray(semantic_scores, dtype=np.float64) * (config or scoring_config()).semantic_weight
+    return scores + section_keyword_scores
+
+def select_top_sections(sections, scores, k=TOP_K, per_document_cap=MAX_SECTIONS_PER_DOCUMENT):
+    """
+    Picks the k best-scoring sections with argpartition instead of a full
+    sort. Equal scores are ordered by page number, then input order.
+    Sections with a non-finite score are never selected, and with a
+    per_document_cap no document contributes more than that many sections.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    candidates = np.flatnonzero(np.isfinite(scores))
+    if k <= 0 or len(candidates) == 0:
+        return []
+    candidate_scores = scores[candidates]
+    pages = np.array([sections[i]['page_number'] for i in candidates])
+    pool_size = k
+    while True:
+        if pool_size < len(candidates):
+            threshold = -np.partition(-candidate_scores, pool_size - 1)[pool_size - 1]
+            # Keep every candidate tied with the cutoff so ties resolve by page
+            pool = np.flatnonzero(candidate_scores >= threshold)
+        else:
+            pool = np.arange(len(candidates))
+        order = pool[np.lexsort((pool, pages[pool], -candidate_scores[pool]))]
+        selected = []
+        per_document = {}
+        for j in order:
+            section = sections[candidates[j]]
+            if per_document_cap:
+                count = per_document.get(section['document'], 0)
+                if count >= per_document_cap:
+                    continue
+                per_document[section['document']] = count + 1
+            selected.append((section, float(candidate_scores[j])))
+            if len(selected) == k:
+                return selected
+        if len(pool) == len(candidates):
+            return selected
+        # The cap skipped too many sections; widen the pool and try again
+        pool_size *= 2
+
+def index_sections(section_embeddings, backend=VECTOR_INDEX):
+    return build_index(section_embeddings, backend)
+
+def semantic_candidates(section_index, query_embeddings):
+    """
+    One (section_ids, cosine similarities) pair per query, in section order:
+    every section with the exact index, only each query's ANN_CANDIDATES
+    nearest with an approximate one.
+    """
+    return section_index.search(query_embeddings, ann_candidates(section_index))
+
+def ann_candidates(section_index):
+    """How many semantic candidates keyword scoring re-ranks; None for all of them."""
+    return ANN_CANDIDATES if section_index.kind != "exact" and ANN_CANDIDATES > 0 else None
+
+def rank_sections(sections, section_index, query_embedding, query, job, config=None):
+    if not sections:
+        return []
+    config = config or scoring_config()
+    ids, semantic = semantic_candidates(section_index, [query_embedding])[0]
+    # Keyword scoring only re-ranks the semantic candidates
+    candidates = [sections[i] for i in ids]
+    scores = combine_scores(semantic, keyword_scores(candidates, query, job, config), config)
+    return select_top_sections(candidates, scores)
+
+def process_sections_intelligently(all_sections, query, job, query_embedding=None, config=None):
+    config = config or scoring_config()
+    filtered_sections = filter_sections(all_sections, job, config)
+    with METRICS.stage("embed_sections"):
+        section_index = index_sections(embed_sections(filtered_sections)) if filtered_sections else None
+    if query_embedding is None:
+        with METRICS.stage("encode_query"):
+            query_embedding = encode_texts([query])[0]
+    
+    with METRICS.stage("scoring"):
+        return rank_sections(filtered_sections, section_index, query_embedding, query, job, config)
+
+def get_corpus_index(path=CORPUS_INDEX_DIR, config=None):
+    config = config or scoring_config()
+    corpus = CorpusIndex(path, embedding_model_id(), config.keyword_scorer.signature, VECTOR_INDEX)
+    corpus_keyword_scorer(corpus, config)
+    return corpus
+
+def corpus_keyword_scorer(corpus, config=None):
+    """The config's keyword scorer, with the corpus index's keyword hits brought up to date for it."""
+    scorer = (config or scoring_config()).keyword_scorer
+    corpus.keyword_signature = scorer.signature
+    if corpus.stale_keywords():
+        print("Keywords in query_config.py changed; recomputing corpus index keyword hits")
+        corpus.rematch(scorer.match_sections)
+    return scorer
+
+def update_corpus_index(corpus, pdf_paths, remove_missing=False, config=None):
+    """
+    Adds new and changed PDFs to the corpus index; unchanged documents are
+    not touched. New documents are parsed across the worker pool and
+    embedded in one call. Documents that fail to parse are not indexed and
+    are retried on the next update. With remove_missing, indexed documents
+    that are not among pdf_paths are removed.
+    """
+    scorer = corpus_keyword_scorer(corpus, config)
+    stale = [pdf_path for pdf_path in pdf_paths if not corpus.is_current(pdf_path)]
+    parsed = dict(iter_documents(stale))
+    new_sections = [section for pdf_path in stale for section in parsed[pdf_path]]
+    embeddings = embed_sections(new_sections) if new_sections else None
+    offsets = {}
+    offset = 0
+    for pdf_path in stale:
+        offsets[pdf_path] = (offset, offset + len(parsed[pdf_path]))
+        offset += len(parsed[pdf_path])
+
+    def build(pdf_path):
+        sections = parsed[pdf_path]
+        if not sections:
+            return None
+        start, end = offsets[pdf_path]
+        return sections, embeddings[start:end], scorer.match_sections(sections)
+
+    changes = corpus.sync(pdf_paths, build, remove_missing)
+    if (changes["added"] or changes["replaced"] or changes["removed"]) and corpus.documents():
+        # Built now rather than by the first query against the new documents
+        corpus.vector_index()
+    print(
+        f"Corpus index: {len(changes['added'])} added, {len(changes['replaced'])} replaced, "
+        f"{len(changes['removed'])} removed, {len(changes['failed'])} failed, {changes['unchanged']} unchanged"
+    )
+    return changes
+
+def rank_corpus_index(corpus, query, job, documents=None, query_embedding=None, config=None):
+    """
+    process_sections_intelligently against the corpus index: stored keyword
+    hits and the stored vector index are reused, only the query is encoded.
+    With documents, only those documents are ranked, in the order given.
+    """
+    config = config or scoring_config()
+    scorer = corpus_keyword_scorer(corpus, config)
+    sections, embeddings, (title_hits, text_hits) = corpus.load()
+    rows = np.arange(len(sections))
+    if documents is not None:
+        positions = {name: i for i, name in enumerate(documents)}
+        rows = np.array(
+            sorted((i for i, s in enumerate(sections) if s['document'] in positions), key=lambda i: positions[sections[i]['document']]),
+            dtype=np.intp,
         )
-        combined_score = semantic_score + intelligent_score
-        combined_scores.append((section, combined_score))
-    
-    top_sections = sorted(combined_scores, key=lambda x: -x[1])[:TOP_K]
-    
-    return top_sections
+    with METRICS.stage("filter"):
+        keep = rows[scorer.include_mask((title_hits[rows], text_hits[rows]))]
+    METRICS.count("sections_parsed", len(rows))
+    METRICS.count("sections_filtered_out", len(rows) - len(keep))
+    if len(keep) == 0:
+        print("Warning: No sections passed the intelligent filter. Using all sections.")
+        keep = rows
+    if len(keep) == 0:
+        return []
+    if query_embedding is None:
+        with METRICS.stage("encode_query"):
+            query_embedding = encode_texts([query])[0]
+    with METRICS.stage("scoring"):
+        section_index = corpus.vector_index()
+        k = ann_candidates(section_index)
+        if k is not None and len(keep) <= k:
+            # Every kept row is a candidate anyway: score them exactly, as an index over them would
+            ids, semantic = index_sections(embeddings[keep], "exact").search([query_embedding])[0]
+        else:
+            # Only kept rows compete for the candidate slots, taken in the order of keep
+            ids, semantic = section_index.search_rows(query_embedding, keep, k)
+        candidates = keep[ids]
+        candidate_sections = [sections[i] for i in candidates]
+        scores = combine_scores(
+            semantic,
+            scorer.scores((title_hits[candidates], text_hits[candidates]), [s['document'] for s in candidate_sections]),
+            config,
+        )
+        return select_top_sections(candidate_sections, scores)
 
-def main():
-    print("Starting intelligent document analysis...")
-    
-    input_data, persona, job, filenames = load_input_data()
-    
-    print(f"Persona: {persona}")
-    print(f"Job: {job}")
-    print(f"Documents: {len(filenames)}")
-    
-    all_sections = []
-    for file in filenames:
-        pdf_path = os.path.join(PDF_DIR, file)
-        if os.path.exists(pdf_path):
-            print(f"Processing: {file}")
-            try:
-                doc_analysis = extract_outline_and_text(pdf_path)
-                for section in doc_analysis['outline']:
-                    all_sections.append({
-                        "document": os.path.basename(pdf_path),
-                        "section_title": clean_for_json(section.get("text", "")),
-                        "text": clean_for_json(section.get("content_text", "")),
-                        "page_number": section.get("page", 1),
-                    })
-            except Exception as e:
-                print(f"Error processing {file}: {e}")
+def iter_section_batches(filenames, pdf_dir=PDF_DIR, batch_size=STREAM_BATCH_SIZE):
+    batch = []
+    for _, sections in iter_documents(_existing_paths(filenames, pdf_dir)):
+        for section in sections:
+            batch.append(section)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def _merge_top(top_sections, sections, scores):
+    candidates = [section for section, _ in top_sections] + sections
+    candidate_scores = np.concatenate([[score for _, score in top_sections], scores])
+    return select_top_sections(candidates, candidate_scores)
+
+def stream_top_sections(filenames, query, job, pdf_dir=PDF_DIR, batch_size=STREAM_BATCH_SIZE, query_embedding=None, config=None):
+    """
+    Streaming equivalent of load_sections + process_sections_intelligently.
+    Sections are filtered, embedded and scored in micro-batches as documents
+    come out of the parser pool, and only the running top K is kept. Memory
+    does not grow with the corpus, but is bounded by the largest documents
+    in flight, up to two per parse worker, each with its span table in the
+    worker and its body text and sections on the way back, plus one batch.
+    Newly encoded embeddings are cached in chunks of the embedding cache's
+    flush_rows rather than one shard per micro-batch, so up to flush_rows
+    embeddings are held as well.
+    """
+    if query_embedding is None:
+        with METRICS.stage("encode_query"):
+            query_embedding = encode_texts([query])[0]
+    config = config or scoring_config()
+    scorer = config.keyword_scorer
+    top_sections = []
+    # Ranked over unfiltered sections only until one passes the filter, for the same fallback as filter_sections
+    fallback_sections = []
+    passed = 0
+    try:
+        for batch in iter_section_batches(filenames, pdf_dir, batch_size):
+            with METRICS.stage("filter"):
+                title_hits, text_hits = scorer.match_sections(batch)
+                include = scorer.include_mask((title_hits, text_hits))
+            METRICS.count("sections_parsed", len(batch))
+            METRICS.count("sections_filtered_out", len(batch) - int(include.sum()))
+            passed += int(include.sum())
+            keep = np.flatnonzero(include) if passed else np.arange(len(batch))
+            if len(keep) == 0:
                 continue
-    
-    query = build_intelligent_query(persona, job)
-    
-    top_sections = process_sections_intelligently(all_sections, query, job)
-    
+            sections = [batch[i] for i in keep]
+            with METRICS.stage("embed_sections"):
+                section_index = index_sections(embed_sections(sections, defer=True), "exact")
+            with METRICS.stage("scoring"):
+                _, semantic = semantic_candidates(section_index, [query_embedding])[0]
+                scores = combine_scores(
+                    semantic,
+                    scorer.scores((title_hits[keep], text_hits[keep]), [s['document'] for s in sections]),
+                    config,
+                )
+                if passed:
+                    top_sections = _merge_top(top_sections, sections, scores)
+                else:
+                    fallback_sections = _merge_top(fallback_sections, sections, scores)
+    finally:
+        # New embeddings are stored in large shards instead of one per micro-batch
+        flush_embedding_cache()
+    if not passed:
+        print("Warning: No sections passed the intelligent filter. Using all sections.")
+        return fallback_sections
+    return top_sections
+
+def build_output(top_sections, filenames, persona, job, query):
     output = {
         "metadata": {
             "input_documents": filenames,
@@ -219,7 +605,8 @@ def main():
     }
 
     for rank, (sec, score) in enumerate(top_sections, start=1):
-        refined_text = clean_for_json(sec["text"])[:1000]
+        # sec["text"] was already normalized by parse_document
+        refined_text = sec["text"][:1000]
         
         output["extracted_sections"].append({
             "document": sec["document"],
@@ -233,18 +620,183 @@ def main():
             "page_number": sec["page_number"],
         })
 
-    output_path = "output/challenge_output.json"
+    return convert_to_json_serializable(output)
+
+def export_metrics(output=None):
+    """Adds the collected metrics to output's metadata and/or METRICS_FILE, as configured."""
+    if METRICS_IN_OUTPUT and output is not None:
+        output["metadata"]["instrumentation"] = convert_to_json_serializable(METRICS.to_dict())
+    if METRICS_FILE:
+        try:
+            METRICS.write_prometheus(METRICS_FILE)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+def main(stream=False, from_index=False):
+    print("Starting intelligent document analysis...")
+    METRICS.reset()
+    
+    input_data, persona, job, filenames = load_input_data()
     
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    print(f"Persona: {persona}")
+    print(f"Job: {job}")
+    print(f"Documents: {len(filenames)}")
+    
+    # One config version for the whole run, even if query_config.py changes meanwhile
+    config = scoring_config()
+    queries, query_embeddings = query_artefacts([(persona, job)], config)
+    query, query_embedding = queries[0], query_embeddings[0]
+    
+    if stream:
+        top_sections = stream_top_sections(filenames, query, job, query_embedding=query_embedding, config=config)
+    elif from_index:
+        corpus = get_corpus_index(config=config)
+        with METRICS.stage("parse"):
+            update_corpus_index(corpus, _existing_paths(filenames, PDF_DIR), config=config)
+        top_sections = rank_corpus_index(corpus, query, job, filenames, query_embedding, config)
+    else:
+        with METRICS.stage("parse"):
+            all_sections = load_sections(filenames)
+        top_sections = process_sections_intelligently(all_sections, query, job, query_embedding, config)
     
-    output = convert_to_json_serializable(output)
+    output = build_output(top_sections, filenames, persona, job, query)
+    export_metrics(output)
+
+    if write_output(output, "output/challenge_output.json"):
+        print(f"Found {len(top_sections)} relevant sections")
+        print("Configuration can be modified in query_config.py")
+
+def run_batch(requests_path, output_dir):
+    """
+    Answers every persona/job request in a JSONL file (one challenge_input.json
+    object per line) against one shared corpus. Documents are parsed and
+    embedded once, queries missing from the query cache are encoded in a
+    single call and all are scored with one similarity search; one output
+    file is written per request.
+    A request that lists documents only ranks sections from those documents;
+    otherwise it ranks the documents of INPUT_JSON_PATH.
+    """
+    with open(requests_path, "r", encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    if not requests:
+        print(f"No requests in {requests_path}")
+        return
+    default_filenames = []
+    if os.path.exists(INPUT_JSON_PATH):
+        default_filenames = load_input_data()[3]
+    parsed = []
+    corpus = []
+    for request in requests:
+        persona, job, filenames = read_request(request)
+        filenames = filenames or default_filenames
+        parsed.append((persona, job, filenames))
+        corpus.extend(f for f in filenames if f not in corpus)
+    print(f"Requests: {len(requests)}")
+    print(f"Documents: {len(corpus)}")
+    
+    METRICS.reset()
+    with METRICS.stage("parse"):
+        all_sections = load_sections(corpus)
+    config = scoring_config()
+    scorer = config.keyword_scorer
+    with METRICS.stage("filter"):
+        hits = scorer.match_sections(all_sections)
+        include = scorer.include_mask(hits)
+    METRICS.count("sections_parsed", len(all_sections))
+    METRICS.count("sections_filtered_out", len(all_sections) - int(include.sum()))
+    # Each request ranks its own documents' filtered sections, or all of them if none pass, as in a single run
+    all_documents = np.array([s['document'] for s in all_sections])
+    request_masks = []
+    for persona, job, filenames in parsed:
+        in_request = np.isin(all_documents, filenames)
+        if not (include & in_request).any():
+            print(f"Warning: No sections passed the intelligent filter for '{job}'. Using all sections.")
+            request_masks.append(in_request)
+        else:
+            request_masks.append(include & in_request)
+    rows = np.flatnonzero(np.logical_or.reduce(request_masks)) if request_masks else np.zeros(0, dtype=np.intp)
+    sections = [all_sections[i] for i in rows]
+    queries, query_embeddings = query_artefacts([(persona, job) for persona, job, _ in parsed], config)
+    with METRICS.stage("embed_sections"):
+        section_index = index_sections(embed_sections(sections)) if sections else None
+    with METRICS.stage("scoring"):
+        if sections:
+            candidates = semantic_candidates(section_index, query_embeddings)
+        else:
+            candidates = [(np.zeros(0, dtype=np.intp), np.zeros(0))] * len(requests)
+        # Keyword scores depend only on the section and query_config, not on the request
+        section_keyword_scores = scorer.scores((hits[0][rows], hits[1][rows]), [s['document'] for s in sections])
+    
+    os.makedirs(output_dir, exist_ok=True)
+    for i, ((persona, job, filenames), query) in enumerate(zip(parsed, queries)):
+        with METRICS.stage("scoring"):
+            ids, semantic = candidates[i]
+            in_request = request_masks[i][rows][ids]
+            ids, semantic = ids[in_request], semantic[in_request]
+            scores = combine_scores(semantic, section_keyword_scores[ids], config)
+            top_sections = select_top_sections([sections[j] for j in ids], scores)
+        output = build_output(top_sections, filenames, persona, job, query)
+        request_id = requests[i].get("request_id") or requests[i].get("challenge_info", {}).get("challenge_id")
+        name = f"{i + 1:04d}_{re.sub(r'[^A-Za-z0-9_.-]', '_', str(request_id))}" if request_id else f"{i + 1:04d}"
+        write_output(output, os.path.join(output_dir, f"{name}.json"))
+    # One metrics report for the whole batch rather than a snapshot per request
+    if METRICS_IN_OUTPUT:
+        write_output(convert_to_json_serializable(METRICS.to_dict()), os.path.join(output_dir, "metrics.json"))
+    export_metrics()
+
+def parse_only(filenames, pdf_dir=PDF_DIR):
+    """Parses (and caches) the documents without loading any embedding model."""
+    total = 0
+    for pdf_path, sections in iter_documents(_existing_paths(filenames, pdf_dir)):
+        print(f"{os.path.basename(pdf_path)}: {len(sections)} sections")
+        total += len(sections)
+    print(f"Parsed {total} sections")
+
+def check_backend_drift(candidate, requests_path=None):
+    """
+    Ranks the input documents with the fp32 model and with another embedding
+    backend, then reports how far the embeddings and the top-K rankings
+    drift. Queries come from challenge_input.json, or every line of
+    requests_path when given.
+    """
+    _, persona, job, filenames = load_input_data()
+    requests = [(persona, job)]
+    if requests_path:
+        with open(requests_path, "r", encoding="utf-8") as f:
+            requests = [read_request(json.loads(line))[:2] for line in f if line.strip()]
+    config = scoring_config()
+    sections = filter_sections(load_sections(filenames), job, config)
+    texts = section_texts(sections)
+    queries = [config.query_builder.build(j) for _, j in requests]
+    model = load_model()
+    report = {"baseline": "fp32", "candidate": candidate, "sections": len(sections)}
+    embeddings = {}
+    rankings = {}
+    for name in ("fp32", candidate):
+        backend = create_backend(name, model)
+        start = time.perf_counter()
+        embeddings[name] = encode_batched(backend, texts, token_budget=ENCODE_TOKEN_BUDGET)
+        report[f"{name}_encode_seconds"] = round(time.perf_counter() - start, 3)
+        section_index = index_sections(embeddings[name])
+        query_embeddings = encode_batched(backend, queries, token_budget=ENCODE_TOKEN_BUDGET)
+        positions = {id(section): i for i, section in enumerate(sections)}
+        rankings[name] = [
+            [positions[id(section)] for section, _ in rank_sections(sections, section_index, query_embedding, query, j, config)]
+            for query_embedding, query, (_, j) in zip(query_embeddings, queries, requests)
+        ]
+    report.update(embedding_drift(embeddings["fp32"], embeddings[candidate]))
+    report.update(ranking_drift(rankings["fp32"], rankings[candidate]))
+    print(json.dumps(report, indent=4))
+    return report
+
+def write_output(output, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
     
     try:
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(output, f, indent=4, ensure_ascii=False)
         print(f"Output written to {output_path}")
-        print(f"Found {len(top_sections)} relevant sections")
-        print("Configuration can be modified in query_config.py")
+        return True
     except Exception as e:
         print(f"Error writing output: {e}")
         try:
@@ -258,6 +810,52 @@ def main():
             print(f"Simplified output written to {output_path}")
         except Exception as e2:
             print(f"Failed to write even simplified output: {e2}")
+        return False
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Intelligent document analysis.")
+    parser.add_argument("--batch", metavar="REQUESTS_JSONL", help="answer many persona/job requests against one corpus")
+    parser.add_argument("--output-dir", default="output/batch", help="where --batch writes one output file per request")
+    parser.add_argument("--stream", action="store_true", help="parse, embed and rank in bounded micro-batches")
+    parser.add_argument("--parse-only", action="store_true", help="only parse the input documents, e.g. to warm the parse cache")
+    parser.add_argument("--save-model-snapshot", metavar="PATH", help="save the model to a local directory or .pt file for MODEL_SNAPSHOT")
+    parser.add_argument("--check-backend-drift", metavar="BACKEND", help="report top-K ranking drift of BACKEND (e.g. int8) against fp32")
+    parser.add_argument("--from-index", action="store_true", help="rank from the corpus index, adding the input documents to it if needed")
+    parser.add_argument("--index-add", nargs="+", metavar="PDF", help="add or replace documents in the corpus index")
+    parser.add_argument("--index-remove", nargs="+", metavar="NAME", help="remove documents from the corpus index")
+    parser.add_argument("--index-sync", metavar="DIR", help="make the corpus index match the PDFs in DIR")
+    parser.add_argument("--index-compact", action="store_true", help="merge the corpus index into one segment, dropping dead rows")
+    parser.add_argument("--metrics", action="store_true", help="add pipeline timings and counts to the output metadata")
+    parser.add_argument("--metrics-file", help="also write the metrics to this Prometheus text file")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"], help="profile every pipeline stage")
+    args = parser.parse_args()
+    METRICS_IN_OUTPUT = METRICS_IN_OUTPUT or args.metrics
+    METRICS_FILE = args.metrics_file or METRICS_FILE
+    if args.profile:
+        METRICS.reset(profile=args.profile)
+    if args.check_backend_drift:
+        check_backend_drift(args.check_backend_drift, args.batch)
+    elif args.save_model_snapshot:
+        save_model_snapshot(args.save_model_snapshot)
+    elif args.parse_only:
+        parse_only(load_input_data()[3])
+    elif args.batch:
+        run_batch(args.batch, args.output_dir)
+    elif args.index_add or args.index_remove or args.index_sync or args.index_compact:
+        config = scoring_config()
+        corpus = get_corpus_index(config=config)
+        if args.index_sync:
+            pdf_paths = sorted(os.path.join(args.index_sync, f) for f in os.listdir(args.index_sync) if f.lower().endswith(".pdf"))
+            update_corpus_index(corpus, pdf_paths, remove_missing=True, config=config)
+        if args.index_add:
+            update_corpus_index(corpus, args.index_add, config=config)
+        for name in args.index_remove or []:
+            if not corpus.remove(os.path.basename(name)):
+                print(f"Not in the corpus index: {name}")
+        if args.index_compact:
+            corpus.compact()
+        if corpus.documents():
+            corpus.vector_index()
+        print(json.dumps(corpus.stats()))
+    else:
+        main(stream=args.stream, from_index=args.from_index)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import os
+import zlib
+import uuid
+import pickle
+import struct
+import hashlib
+
+# magic, file size, file mtime (ns), file sha1, parser sha1
+HEADER = struct.Struct("<4sQq20s20s")
+MAGIC = b"PC04"
+PARSER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "round_1a_parser.py")
+
+_parser_digest = None
+
+def parser_digest():
+    """Hash of the parser source, so entries are invalidated when the parser changes."""
+    global _parser_digest
+    if _parser_digest is None:
+        with open(PARSER_SOURCE, "rb") as f:
+            _parser_digest = hashlib.sha1(f.read()).digest()
+    return _parser_digest
+
+def file_digest(path, chunk_size=1024 * 1024, data=None):
+    """SHA-1 of the file; data, a buffer already holding its content, is hashed in place instead."""
+    if data is not None:
+        return hashlib.sha1(data).digest()
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.digest()
+
+def _pack(result):
+    outline = [
+        (s["level"], s["text"], s["page"], s["body_start"], s["body_end"])
+        for s in result["outline"]
+    ]
+    counts = (result.get("page_count", 0), result.get("span_count", 0))
+    return zlib.compress(pickle.dumps((result["title"], result["body"], outline, counts), protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+def _unpack(payload):
+    title, body, outline, (page_count, span_count) = pickle.loads(zlib.decompress(payload))
+    return {
+        "title": title,
+        "outline": [
+            {"level": level, "text": text, "page": page, "body_start": start, "body_end": end}
+            for level, text, page, start, end in outline
+        ],
+        "body": body,
+        "page_count": page_count,
+        "span_count": span_count,
+    }
+
+class ParseCache:
+    """
+    On-disk cache of extract_outline_and_text results, one file per PDF path.
+
+    Each entry is a fixed binary header (file size, mtime, content sha1 and
+    parser sha1) followed by a zlib-compressed pickle of the title, body
+    buffer, outline rows and page/span counts. An entry is used when size
+    and mtime match, or when only the mtime changed but the content hash
+    still matches; anything else, including a change to round_1a_parser.py,
+    re-parses the file.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, pdf_path):
+        name = hashlib.sha1(os.path.abspath(pdf_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name + ".bin")
+
+    def load(self, pdf_path, data=None):
+        """Returns the cached result for pdf_path, or None if missing or stale."""
+        entry_path = self._entry_path(pdf_path)
+        try:
+            stat = os.stat(pdf_path)
+            with open(entry_path, "rb") as f:
+                header = f.read(HEADER.size)
+                if len(header) != HEADER.size:
+                    return None
+                magic, size, mtime_ns, digest, parser = HEADER.unpack(header)
+                if magic != MAGIC or parser != parser_digest() or size != stat.st_size:
+                    return None
+                touched = mtime_ns != stat.st_mtime_ns
+                if touched and digest != file_digest(pdf_path, data=data):
+                    return None
+                result = _unpack(f.read())
+            if touched:
+                # Same content under a new mtime: refresh it to skip hashing next time
+                with open(entry_path, "r+b") as f:
+                    f.write(HEADER.pack(MAGIC, size, stat.st_mtime_ns, digest, parser))
+            return result
+        except (OSError, ValueError, EOFError, zlib.error, pickle.UnpicklingError):
+            return None
+
+    def store(self, pdf_path, result, stat=None, data=None):
+        stat = stat or os.stat(pdf_path)
+        header = HEADER.pack(MAGIC, stat.st_size, stat.st_mtime_ns, file_digest(pdf_path, data=data), parser_digest())
+        entry_path = self._entry_path(pdf_path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(header)
+                f.write(_pack(result))
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            print(f"Could not write parse cache for {pdf_path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def get_or_parse(self, pdf_path, parse_fn, data=None):
+        """
+        With data, a buffer holding the file (e.g. a map_file view), parsing
+        and hashing both read that buffer instead of the file.
+        """
+        result = self.load(pdf_path, data)
+        if result is not None:
+            return result
+        stat = os.stat(pdf_path)
+        result = parse_fn(pdf_path if data is None else data)
+        # Failed or empty parses are cheap to redo and should not stick
+        if result.get("outline"):
+            self.store(pdf_path, result, stat, data)
+        return result
@@ -0,0 +1,78 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from embedding_cache import _model_slug
+
+class QueryCache:
+    """
+    Query-side artefacts of each request: the query built from the job and
+    its embedding, keyed by persona, job and the signature of the query
+    config that built them, so editing query_config.py starts over.
+
+    Entries live in an in-memory LRU shared by every caller in the process.
+    With a path they are also persisted as one .npz file per model,
+    replaced atomically on save, so later runs start warm.
+    """
+
+    def __init__(self, path, model_id, max_entries=1024):
+        self.path = os.path.join(path, f"{_model_slug(model_id)}.npz") if path else None
+        self.max_entries = max_entries
+        # key -> (query, embedding), least recently used first
+        self._entries = OrderedDict()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def key(persona, job, config_signature):
+        return hashlib.sha1(json.dumps([persona, job, config_signature]).encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with np.load(self.path) as data:
+                keys, queries, embeddings = data["keys"], data["queries"], data["embeddings"]
+        except (OSError, ValueError, KeyError):
+            return
+        for key, query, embedding in zip(keys.tolist(), queries.tolist(), embeddings):
+            self._entries[key] = (query, embedding)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns (query, embedding), or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, query, embedding):
+        with self._lock:
+            self._entries[key] = (query, np.asarray(embedding, dtype=np.float32))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty or not self._entries:
+                return
+            keys = list(self._entries)
+            queries = [self._entries[key][0] for key in keys]
+            embeddings = np.stack([self._entries[key][1] for key in keys])
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, keys=np.array(keys), queries=np.array(queries), embeddings=embeddings)
+        os.replace(tmp_path, self.path)
@@ -1,19 +1,54 @@
 import fitz  # PyMuPDF
+import os
 import json
 import re
-from collections import Counter
+import mmap
+import random
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from contextlib import contextmanager
 
-def get_font_statistics(doc):
-    font_counts = Counter()
-    size_counts = Counter()
-    for page in doc:
-        blocks = page.get_text("dict")["blocks"]
+# One row per text span, decoded from each page exactly once. `line_start`
+# marks the first span of a PDF text line, which is what heading detection
+# looks at; every row feeds the font statistics.
+Span = namedtuple("Span", ["page", "size", "font", "bold", "text", "line_start"])
+
+# "dict" output without embedded image bytes, which we never look at.
+TEXT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+# sample_font_statistics stops at this confidence; past FONT_SAMPLE_MAX_SHARE of the pages it scans them all instead.
+FONT_SAMPLE_CONFIDENCE = float(os.environ.get("FONT_SAMPLE_CONFIDENCE", "0.95"))
+FONT_SAMPLE_MAX_SHARE = float(os.environ.get("FONT_SAMPLE_MAX_SHARE", "0.25"))
+# Rarest heading size, as a share of pages, that the confidence vouches for having sampled.
+FONT_SAMPLE_MIN_PAGE_SHARE = float(os.environ.get("FONT_SAMPLE_MIN_PAGE_SHARE", "0.01"))
+# The body size is ambiguous while the runner-up size has this share of the commonest size's spans.
+BODY_SIZE_MARGIN = 0.8
+
+def extract_spans(doc):
+    spans = []
+    bold_fonts = {}
+    for page_num, page in enumerate(doc):
+        blocks = page.get_text("dict", flags=TEXT_FLAGS)["blocks"]
         for b in blocks:
-            if b['type'] == 0:
-                for l in b["lines"]:
-                    for s in l["spans"]:
-                        font_counts[s['font']] += 1
-                        size_counts[round(s['size'])] += 1
+            if b['type'] != 0:
+                continue
+            for l in b["lines"]:
+                line_start = True
+                for s in l["spans"]:
+                    font = s['font']
+                    bold = bold_fonts.get(font)
+                    if bold is None:
+                        bold = bold_fonts[font] = is_bold(font)
+                    spans.append(Span(page_num, round(s['size']), font, bold, s['text'], line_start))
+                    line_start = False
+    return spans
+
+def get_font_statistics(spans):
+    if not isinstance(spans, list):
+        spans = extract_spans(spans)
+    return _font_levels(Counter(s.size for s in spans))
+
+def _font_levels(size_counts):
     body_size = size_counts.most_common(1)[0][0] if size_counts else 12
     potential_heading_sizes = sorted([size for size in size_counts if size > body_size], reverse=True)
     heading_levels = {}
@@ -25,82 +60,288 @@ def get_font_statistics(doc):
         heading_levels[potential_heading_sizes[2]] = "H3"
     return body_size, heading_levels
 
+def _random_pages(page_count):
+    """Every page number in a random order that is the same for every document of page_count pages."""
+    pages = list(range(page_count))
+    random.Random(page_count).shuffle(pages)
+    return pages
+
+def sample_font_statistics(source, page_count=None, batch_pages=10, patience=2, min_confidence=None, max_share=None, min_page_share=None):
+    """
+    get_font_statistics from a random sample of pages instead of all of them.
+    source is an open document, of which only the sampled pages are
+    decoded, or a span table. Decoding is where the time goes, so this only
+    pays off for callers that need the font sizes without the spans;
+    counting sizes in a span table already in memory is cheap. Pages are added batch_pages at a time until the body
+    and heading sizes have not changed for patience batches, the body size
+    is clear and the confidence reaches min_confidence. Failing that within
+    max_share of the pages, every page is scanned after all.
+
+    The confidence is the Good-Turing estimate that an unsampled page holds
+    no unseen size above the body size: 1 minus the share of sampled pages
+    with a larger size found on no other sampled page. A size on no sampled
+    page leaves no singletons to count, so the confidence is at most the
+    chance that a size on min_page_share of the pages would be on a sampled
+    page; with the defaults that takes about 300 pages, so documents shorter
+    than some 1200 pages are always scanned in full.
+
+    Returns (body_size, heading_levels, info), info being {'sampled',
+    'pages_scanned', 'confidence'}.
+    """
+    if min_confidence is None:
+        min_confidence = FONT_SAMPLE_CONFIDENCE
+    if max_share is None:
+        max_share = FONT_SAMPLE_MAX_SHARE
+    if min_page_share is None:
+        min_page_share = FONT_SAMPLE_MIN_PAGE_SHARE
+    if isinstance(source, list):
+        spans = source
+        if page_count is None:
+            page_count = spans[-1].page + 1 if spans else 0
+        # The span table is in page order; bisect has no key= before Python 3.10
+        span_pages = [s.page for s in spans]
+
+        def page_sizes(page_num):
+            start = bisect_left(span_pages, page_num)
+            end = bisect_left(span_pages, page_num + 1, lo=start)
+            return [s.size for s in spans[start:end]]
+    else:
+        page_count = source.page_count
+
+        def page_sizes(page_num):
+            blocks = source[page_num].get_text("dict", flags=TEXT_FLAGS)["blocks"]
+            return [round(s["size"]) for b in blocks if b["type"] == 0 for l in b["lines"] for s in l["spans"]]
+    size_counts = Counter()
+    size_pages = Counter()
+    levels = None
+    stable = 0
+    pages_scanned = 0
+    for page_num in _random_pages(page_count):
+        sizes = page_sizes(page_num)
+        size_counts.update(sizes)
+        size_pages.update(set(sizes))
+        pages_scanned += 1
+        if pages_scanned % batch_pages and pages_scanned < page_count:
+            continue
+        current = _font_levels(size_counts)
+        stable = stable + 1 if current == levels else 0
+        levels = current
+        body_size = levels[0]
+        singletons = sum(1 for size, pages in size_pages.items() if size > body_size and pages == 1)
+        confidence = min(1 - singletons / pages_scanned, 1 - (1 - min_page_share) ** pages_scanned)
+        top = size_counts.most_common(2)
+        clear_body = len(top) < 2 or top[1][1] < BODY_SIZE_MARGIN * top[0][1]
+        if stable >= patience and clear_body and confidence >= min_confidence:
+            return body_size, levels[1], {"sampled": True, "pages_scanned": pages_scanned, "confidence": round(confidence, 4)}
+        if pages_scanned >= max_share * page_count:
+            break
+    body_size, heading_levels = get_font_statistics(source)
+    return body_size, heading_levels, {"sampled": False, "pages_scanned": page_count, "confidence": 1.0}
+
+def get_text_buffer(spans, page_count):
+    """
+    Joins the span table into one newline-separated text buffer for the whole
+    document. Returns (buffer, line_offsets, page_offsets): the start offset of
+    every text line and of every page, each list ending with len(buffer).
+    """
+    lines = []
+    line_pages = []
+    for s in spans:
+        if s.line_start:
+            lines.append(s.text)
+            line_pages.append(s.page)
+        else:
+            lines[-1] += s.text
+    line_offsets = []
+    page_offsets = []
+    offset = 0
+    for page_num, text in zip(line_pages, lines):
+        while len(page_offsets) <= page_num:
+            page_offsets.append(offset)
+        line_offsets.append(offset)
+        offset += len(text) + 1
+    line_offsets.append(offset)
+    while len(page_offsets) <= page_count:
+        page_offsets.append(offset)
+    buffer = "\n".join(lines) + "\n" if lines else ""
+    return buffer, line_offsets, page_offsets
+
+def get_section_text(doc_analysis, section):
+    """Returns the body of an outline section as a slice of the document buffer."""
+    return doc_analysis["body"][section["body_start"]:section["body_end"]]
+
 def is_bold(font_name):
     return any(x in font_name.lower() for x in ['bold', 'black', 'heavy'])
 
-def extract_outline_and_text(pdf_path):
+def open_document(source):
     """
-    Extracts structured outline (Title, H1, H2, H3 with page numbers)
-    and associated text content from a PDF using PyMuPDF (fitz).
-    Returns a dict with 'title' and 'outline' (list of sections).
-    Each section: {'level', 'text', 'page', 'content_text'}
+    Opens a PDF from a file path or from an in-memory buffer: bytes,
+    bytearray, memoryview, mmap or a binary file object.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source)
+    if hasattr(source, "read"):
+        source = source.read()
+    if not isinstance(source, (bytes, bytearray)):
+        # PyMuPDF reads memoryviews in place; mmap and other buffers are wrapped in one
+        source = memoryview(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+@contextmanager
+def map_file(path):
+    """
+    Memory-maps a PDF read-only and yields a memoryview of it. open_document
+    and hashlib both read the view in place, so the file is paged in by the
+    OS on demand and shared by every pass instead of being copied into a
+    Python bytes object.
     """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            yield memoryview(b"")
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        finally:
+            try:
+                view.release()
+                mapped.close()
+            except BufferError:
+                # A parse error in flight still references the buffer; it is unmapped once the error is freed
+                pass
+
+def extract_document(source, include_body=True):
+    """
+    The extraction engine behind extract_outline_and_text and the outline API.
+    Opens source (see open_document), decodes every page once and detects
+    the title and the H1-H3 outline from the font statistics. Pages without
+    headings fall back to one section per page, titled by its first line.
+
+    Returns {'title', 'outline', 'page_count', 'span_count'}; each outline
+    entry is {'level', 'text', 'page'} with 1-based pages. The font
+    statistics count every decoded span, since all pages are decoded
+    anyway. With include_body
+    the result also has 'body', the text of the whole document in reading
+    order, and every entry gets 'body_start'/'body_end' offsets into it;
+    without it no body text is assembled at all. Errors are raised.
+    """
+    with open_document(source) as doc:
+        page_count = doc.page_count
+        if page_count == 0:
+            result = {"title": "", "outline": [], "page_count": 0, "span_count": 0}
+            if include_body:
+                result["body"] = ""
+            return result
+        spans = extract_spans(doc)
+    body_size, heading_levels = get_font_statistics(spans)
+    buffer = line_offsets = page_offsets = None
+    if include_body:
+        buffer, line_offsets, page_offsets = get_text_buffer(spans, page_count)
     outline = []
-    title = "Extracted Document Title"
-    try:
-        doc = fitz.open(pdf_path)
-        if doc.page_count == 0:
-            return {"title": "", "outline": []}
-        body_size, heading_levels = get_font_statistics(doc)
-        potential_title = ""
-        max_title_size = 0
-        current_heading = {"text": "", "level": None, "page": 0, "content_text": ""}
-        def commit_current_heading():
-            if current_heading["text"]:
-                clean_text = re.sub(r'^\d+(\.\d+)*\s*', '', current_heading["text"]).strip()
-                outline.append({
-                    "level": current_heading["level"],
-                    "text": clean_text,
-                    "page": current_heading["page"] + 1,  # 0-indexed to 1-indexed
-                    "content_text": current_heading["content_text"]
-                })
-                current_heading["text"] = ""
-                current_heading["level"] = None
-                current_heading["content_text"] = ""
-        for page_num, page in enumerate(doc, 0):
-            blocks = page.get_text("dict")["blocks"]
-            for b in blocks:
-                if b['type'] == 0:
-                    for l in b["lines"]:
-                        if len(l['spans']) == 0 or len(l['spans'][0]['text'].strip()) < 3:
-                            continue
-                        span = l['spans'][0]
-                        text = span['text'].strip()
-                        size = round(span['size'])
-                        font = span['font']
-                        if page_num <= 1 and size > max_title_size:
-                            max_title_size = size
-                            potential_title = text
-                        level = heading_levels.get(size)
-                        if level and (is_bold(font) or size > body_size + 2):
-                            commit_current_heading()
-                            current_heading["text"] = text
-                            current_heading["level"] = level
-                            current_heading["page"] = page_num
-                            current_heading["content_text"] = page.get_text()
-                        elif level and current_heading["level"] == level:
-                            current_heading["text"] += " " + text
-                        else:
-                            commit_current_heading()
+    heading_starts = []
+    potential_title = ""
+    max_title_size = 0
+    current_heading = {"text": "", "level": None, "page": 0, "start": 0, "body_start": 0}
+    def commit_current_heading():
+        if current_heading["text"]:
+            clean_text = re.sub(r'^\d+(\.\d+)*\s*', '', current_heading["text"]).strip()
+            entry = {
+                "level": current_heading["level"],
+                "text": clean_text,
+                "page": current_heading["page"] + 1,  # 0-indexed to 1-indexed
+            }
+            if include_body:
+                entry["body_start"] = current_heading["body_start"]
+                entry["body_end"] = len(buffer)
+                heading_starts.append(current_heading["start"])
+            outline.append(entry)
+            current_heading["text"] = ""
+            current_heading["level"] = None
+    page_num = 0
+    line_num = -1
+    for span in spans:
+        if span.page != page_num:
             # Commit any heading at the end of the page
             commit_current_heading()
-        if not outline:
-            # Fallback: treat each page as a section with first non-empty line
-            for i, page in enumerate(doc):
-                page_text = page.get_text()
-                lines = [line.strip() for line in page_text.split('\n') if line.strip()]
-                first_line = lines[0] if lines else "Untitled Page"
-                outline.append({
-                    "level": "H1",
-                    "text": first_line,
-                    "page": i + 1,
-                    "content_text": page_text
-                })
-        title = potential_title or title
+            page_num = span.page
+        if not span.line_start:
+            continue
+        line_num += 1
+        text = span.text.strip()
+        if len(text) < 3:
+            continue
+        size = span.size
+        if page_num <= 1 and size > max_title_size:
+            max_title_size = size
+            potential_title = text
+        level = heading_levels.get(size)
+        if level and (span.bold or size > body_size + 2):
+            commit_current_heading()
+            current_heading["text"] = text
+            current_heading["level"] = level
+            current_heading["page"] = page_num
+            if include_body:
+                current_heading["start"] = line_offsets[line_num]
+                current_heading["body_start"] = line_offsets[line_num + 1]
+        elif level and current_heading["level"] == level:
+            current_heading["text"] += " " + text
+            if include_body:
+                current_heading["body_start"] = line_offsets[line_num + 1]
+        else:
+            commit_current_heading()
+    commit_current_heading()
+    # Each body runs until the next heading starts, possibly pages later
+    for section, next_start in zip(outline, heading_starts[1:]):
+        section["body_end"] = next_start
+    if not outline:
+        # Fallback: treat each page as a section with first non-empty line
+        if buffer is None:
+            buffer, _, page_offsets = get_text_buffer(spans, page_count)
+        for i in range(page_count):
+            start, end = page_offsets[i], page_offsets[i + 1]
+            lines = [line.strip() for line in buffer[start:end].split('\n') if line.strip()]
+            first_line = lines[0] if lines else "Untitled Page"
+            entry = {"level": "H1", "text": first_line, "page": i + 1}
+            if include_body:
+                entry["body_start"] = start
+                entry["body_end"] = end
+            outline.append(entry)
+    result = {
+        "title": potential_title or "Extracted Document Title",
+        "outline": outline,
+        "page_count": page_count,
+        "span_count": len(spans),
+    }
+    if include_body:
+        result["body"] = buffer
+    return result
+
+def extract_outline(source):
+    """Title and outline only, with no body text work; errors are raised."""
+    return extract_document(source, include_body=False)
+
+def extract_outline_and_text(pdf_path, name=None):
+    """
+    Extracts structured outline (Title, H1, H2, H3 with page numbers)
+    and associated text content from a PDF using PyMuPDF (fitz).
+    Returns a dict with 'title', 'outline' (list of sections) and 'body', the
+    text of the whole document in reading order.
+    Each section: {'level', 'text', 'page', 'body_start', 'body_end'}, where the
+    offsets delimit the section body in 'body': the text after the heading up to
+    the next heading, which may be several pages later. Use get_section_text().
+    'page_count' and 'span_count' describe the decoded PDF.
+    pdf_path may also be a buffer, such as a map_file view; name is then the
+    file name used in messages.
+    """
+    try:
+        return extract_document(pdf_path, include_body=True)
     except Exception as e:
-        print(f"Error processing {pdf_path}: {e}")
-        return {"title": "Unknown Title", "outline": []}
-    return {"title": title, "outline": outline}
+        if name is None:
+            name = pdf_path if isinstance(pdf_path, (str, os.PathLike)) else "PDF buffer"
+        print(f"Error processing {name}: {e}")
+        return {"title": "Unknown Title", "outline": [], "body": ""}
 
 if __name__ == '__main__':
     sample_pdf_path = "sample.pdf" # Make sure you have a sample.pdf for testing
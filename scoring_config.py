@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import runpy
+import hashlib
+import threading
+from keyword_scoring import KeywordScorer, QueryBuilder
+
+TABLES = ("QUERY_KEYWORDS", "BOOST_WORDS", "PENALTY_WORDS", "DOCUMENT_PREFERENCES", "QUERY_TEMPLATES", "SCORING_WEIGHTS")
+
+class ScoringConfig:
+    """
+    The query_config tables compiled once: a KeywordScorer (keyword match
+    tables, boost and penalty weight vectors, weighted document preferences),
+    a QueryBuilder and the semantic similarity weight.
+
+    A config is never modified after it is built; reloading builds a new one
+    and swaps it in, so a caller holding a config always sees one consistent
+    version of the file.
+    """
+
+    def __init__(self, tables, path=None, version=None):
+        missing = [name for name in TABLES if name not in tables]
+        if missing:
+            raise ValueError(f"Query config is missing {', '.join(missing)}")
+        self.keyword_scorer = KeywordScorer(
+            tables["QUERY_KEYWORDS"], tables["BOOST_WORDS"], tables["PENALTY_WORDS"],
+            tables["DOCUMENT_PREFERENCES"], tables["SCORING_WEIGHTS"],
+        )
+        self.query_builder = QueryBuilder(tables["QUERY_TEMPLATES"], tables["QUERY_KEYWORDS"])
+        self.semantic_weight = float(tables["SCORING_WEIGHTS"]["semantic_similarity"])
+        self.path = path
+        self.version = version
+        # Changes whenever any table does, unlike the scorer and builder signatures
+        self.signature = hashlib.sha1(json.dumps([tables[name] for name in TABLES]).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def load(cls, path):
+        version = _file_version(path)
+        # Runs the file like an import, but into a fresh namespace instead of sys.modules
+        return cls(runpy.run_path(path), path, version)
+
+def _file_version(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+class ScoringConfigLoader:
+    """
+    Holds the compiled config of a query_config.py file and hot-reloads it.
+
+    current() looks at the file's mtime and size at most every
+    check_interval seconds (never if negative) and, if they changed,
+    compiles the file and swaps the new config in with one assignment. A
+    file that fails to load or compile is reported once and the previous
+    config stays in use.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._config = ScoringConfig.load(path)
+        self._failed_version = None
+        self._checked = time.monotonic()
+
+    def current(self):
+        if self.check_interval >= 0 and time.monotonic() - self._checked >= self.check_interval:
+            self.reload()
+        return self._config
+
+    def reload(self, force=False):
+        """Recompiles the file if it changed (or with force); returns True if a new config was swapped in."""
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                version = _file_version(self.path)
+            except OSError as e:
+                print(f"Error checking {self.path}: {e}")
+                return False
+            if not force and version in (self._config.version, self._failed_version):
+                return False
+            try:
+                config = ScoringConfig.load(self.path)
+            except Exception as e:
+                self._failed_version = version
+                print(f"Error reloading {self.path}, keeping the previous configuration: {e}")
+                return False
+            self._failed_version = None
+            self._config = config
+            print(f"Reloaded scoring configuration from {self.path}")
+            return True
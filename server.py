@@ -0,0 +1,155 @@
+import os
+import json
+import argparse
+import threading
+import numpy as np
+
+try:
+    from flask import Flask, request, jsonify
+except ImportError:
+    raise ImportError("Flask is not installed. Please install it with 'pip install flask'.")
+
+from main import (
+    PDF_DIR, INPUT_JSON_PATH, get_model, read_request, load_sections, filter_sections,
+    embed_sections, index_sections, query_artefacts, rank_sections, build_output, scoring_config,
+)
+
+app = Flask(__name__)
+
+# name -> {"documents", "all_sections", "embeddings", "sections", "index", "keywords"};
+# replaced as a whole, never mutated
+_collections = {}
+_collections_lock = threading.Lock()
+# Held while a collection is refiltered, so concurrent queries wait for one rebuild
+_rebuild_lock = threading.Lock()
+
+def _build_collection(filenames, all_sections, embeddings, config):
+    # The section filter only depends on the keyword tables, so it is applied once per version of them
+    sections = filter_sections(all_sections, "", config)
+    positions = {id(section): i for i, section in enumerate(all_sections)}
+    rows = [positions[id(section)] for section in sections]
+    return {
+        "documents": filenames, "all_sections": all_sections, "embeddings": embeddings,
+        "sections": sections, "index": index_sections(embeddings[rows]) if sections else None,
+        "keywords": config.keyword_scorer.signature,
+    }
+
+def register_collection(name, filenames, config=None):
+    """
+    Parses and embeds a document collection once and keeps it in memory.
+    Every section is embedded, not only those passing the filter, so a
+    change to the keyword tables never needs the documents again.
+    """
+    config = config or scoring_config()
+    all_sections = load_sections(filenames, PDF_DIR)
+    embeddings = embed_sections(all_sections) if all_sections else np.zeros((0, 0), dtype=np.float32)
+    collection = _build_collection(filenames, all_sections, embeddings, config)
+    with _collections_lock:
+        _collections[name] = collection
+    return collection
+
+def current_collection(name, collection, config):
+    """
+    collection, refiltered and reindexed from its in-memory sections and
+    embeddings if config has other keyword tables than it was filtered
+    with; other config changes leave it as it is. The first request to
+    see the change rebuilds it and the others wait for that rebuild.
+    """
+    signature = config.keyword_scorer.signature
+    if collection["keywords"] == signature:
+        return collection
+    with _rebuild_lock:
+        with _collections_lock:
+            collection = _collections.get(name, collection)
+        if collection["keywords"] == signature:
+            return collection
+        print(f"Keywords in query_config.py changed; refiltering collection '{name}'")
+        rebuilt = _build_collection(collection["documents"], collection["all_sections"], collection["embeddings"], config)
+        with _collections_lock:
+            # Unless the collection was registered again meanwhile
+            if _collections.get(name) is collection:
+                _collections[name] = rebuilt
+        return rebuilt
+
+def answer_query(collection, persona, job, config):
+    # Repeated persona/job pairs reuse the query and embedding from the shared query cache
+    queries, query_embeddings = query_artefacts([(persona, job)], config)
+    query = queries[0]
+    top_sections = []
+    if collection["sections"]:
+        top_sections = rank_sections(collection["sections"], collection["index"], query_embeddings[0], query, job, config)
+    return build_output(top_sections, collection["documents"], persona, job, query)
+
+def _persona_and_job(payload):
+    """Accepts plain strings or the challenge_input.json shape."""
+    persona = payload.get("persona")
+    job = payload.get("job") or payload.get("job_to_be_done")
+    if isinstance(persona, dict) or isinstance(job, dict):
+        persona, job, _ = read_request(payload)
+    return persona, job
+
+@app.route('/collections', methods=['GET'])
+def handle_list_collections():
+    with _collections_lock:
+        collections = dict(_collections)
+    return jsonify({
+        name: {"documents": c["documents"], "sections": len(c["sections"])}
+        for name, c in collections.items()
+    })
+
+@app.route('/collections', methods=['POST'])
+def handle_register_collection():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    name = payload.get("name", "default")
+    filenames = [doc.get("filename") if isinstance(doc, dict) else doc for doc in payload.get("documents", [])]
+    if not filenames:
+        return jsonify({"error": "No documents given"}), 400
+    # Only files directly inside PDF_DIR may be registered
+    if any(not isinstance(f, str) or os.path.basename(f) != f for f in filenames):
+        return jsonify({"error": "Document names must be plain file names"}), 400
+    missing = [f for f in filenames if not os.path.exists(os.path.join(PDF_DIR, f))]
+    if missing:
+        return jsonify({"error": f"Documents not found: {missing}"}), 404
+    try:
+        collection = register_collection(name, filenames)
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
+    return jsonify({"name": name, "documents": filenames, "sections": len(collection["sections"])})
+
+@app.route('/query', methods=['POST'])
+def handle_query():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "The request body must be a JSON object"}), 400
+    persona, job = _persona_and_job(payload)
+    if not persona or not job:
+        return jsonify({"error": "Both persona and job are required"}), 400
+    name = payload.get("collection", "default")
+    with _collections_lock:
+        collection = _collections.get(name)
+    if collection is None:
+        return jsonify({"error": f"Unknown collection: {name}"}), 404
+    # One config version per query, even if query_config.py is reloaded meanwhile
+    config = scoring_config()
+    try:
+        return jsonify(answer_query(current_collection(name, collection, config), persona, job, config))
+    except Exception as e:
+        return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve persona/job queries against resident document collections.")
+    parser.add_argument("--input", default=INPUT_JSON_PATH, help="challenge input whose documents form the 'default' collection")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+
+    get_model()
+    if args.input and os.path.exists(args.input):
+        with open(args.input, "r", encoding="utf-8") as f:
+            _, _, filenames = read_request(json.load(f))
+        if filenames:
+            register_collection("default", filenames)
+            print(f"Registered collection 'default' with {len(filenames)} documents")
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,47 @@
+import re
+
+BULLETS = "\uf0b7\u2022\u2023\u25e6\u2043\u2219"
+# Control characters that are not valid in JSON output (tab, LF and CR are kept as whitespace)
+CONTROL_CHARS = "".join(chr(c) for c in range(0x20) if chr(c) not in "\t\n\r") + "\x7f"
+# Every character for which str.isspace() is true
+WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005"
+    "\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+
+# Runs of list numbering ("12. "), hyphens and asterisks, each with trailing spaces
+_REMOVABLE = r"\d+\.[ ]*|[-*][ ]*"
+# A space absorbs the spaces and removables after it; removables alone vanish
+_PATTERN = re.compile(rf"([ ])(?:[ ]|{_REMOVABLE})*|(?:{_REMOVABLE})+")
+
+class TextNormalizer:
+    """
+    Single-pass equivalent of the old clean_text/clean_for_json regex chain.
+
+    One str.translate drops bullets (and, for JSON output, control
+    characters) and turns every whitespace character into a space. A single
+    regex substitution then removes list numbering, hyphens and asterisks
+    and collapses the remaining space runs.
+    """
+
+    def __init__(self, max_length=None, strip_control=True):
+        table = {ord(c): " " for c in WHITESPACE}
+        if strip_control:
+            table.update({ord(c): None for c in CONTROL_CHARS})
+        table.update({ord(c): None for c in BULLETS})
+        self._table = table
+        self.max_length = max_length
+
+    def normalize(self, text):
+        """Returns (cleaned_text, removed), removed being the characters dropped before truncation."""
+        if not text:
+            return "", 0
+        text = str(text)
+        cleaned = _PATTERN.sub(r"\1", text.translate(self._table)).strip(" ")
+        removed = len(text) - len(cleaned)
+        if self.max_length is not None and len(cleaned) > self.max_length:
+            cleaned = cleaned[:self.max_length] + "..."
+        return cleaned, removed
+
+    def __call__(self, text):
+        return self.normalize(text)[0]
@@ -0,0 +1,184 @@
+import os
+import json
+import numpy as np
+
+META_FILE = "meta.json"
+
+def normalize(matrix):
+    """Row-wise L2 normalization to float32, so dot products are cosine similarities."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_candidates(ids, scores, k=None):
+    """The k best (ids, scores), or all of them without k, in ascending id order."""
+    if k is not None and 0 < k < len(ids):
+        best = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[best], scores[best]
+    order = np.argsort(ids, kind="stable")
+    return ids[order], scores[order]
+
+class ExactIndex:
+    """Brute-force cosine similarity over all vectors with one matrix product."""
+
+    kind = "exact"
+
+    def __init__(self, vectors, normalized=False):
+        self.vectors = vectors if normalized else normalize(vectors)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def scores(self, queries):
+        """Returns an (n_queries, n_vectors) similarity matrix."""
+        return normalize(queries) @ self.vectors.T
+
+    def search(self, queries, k=None):
+        """One (ids, similarities) pair per query: every vector, or the k most similar in id order."""
+        ids = np.arange(len(self.vectors))
+        if k is None or k >= len(ids):
+            return [(ids, row) for row in self.scores(queries)]
+        return [top_candidates(ids, row, k) for row in self.scores(queries)]
+
+    def search_rows(self, query, rows, k=None):
+        """(positions in rows, similarities) of the given rows for one query, or of the k most similar."""
+        scores = np.asarray(self.vectors[rows]) @ normalize(query)[0]
+        return top_candidates(np.arange(len(rows)), scores, k)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        _write_meta(path, {"kind": self.kind})
+
+    @classmethod
+    def load(cls, path, meta, mmap=True):
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        return cls(vectors, normalized=True)
+
+class IVFIndex:
+    """
+    Approximate inverted-file index. Vectors are clustered around spherical
+    k-means centroids and stored grouped by cluster; a query is compared with
+    the centroids and only the vectors of its nprobe closest clusters are
+    scored exactly; nothing is allocated for the other vectors.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, centroids, vectors, ids, offsets, nprobe=8):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, nprobe=8, iterations=10, sample_size=100000, seed=0):
+        vectors = normalize(embeddings)
+        n = len(vectors)
+        n_lists = max(1, min(n, n_lists or int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, min(n, sample_size), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        assignment = _nearest(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+        return cls(centroids, vectors[order], order.astype(np.int64), offsets, nprobe=nprobe)
+
+    def search(self, queries, k=None, nprobe=None):
+        """
+        One (ids, similarities) pair per query over the vectors of its
+        probed clusters only, or the k most similar of those, in id order.
+        """
+        queries = normalize(queries)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for q, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            results.append(top_candidates(np.asarray(self.ids[rows]), np.asarray(self.vectors[rows]) @ queries[q], k))
+        return results
+
+    def search_rows(self, query, rows, k=None):
+        """
+        search for one query restricted to the given rows, returning
+        (positions in rows, similarities). When rows are a small part of the
+        index few of them sit in the nprobe closest clusters, so the number
+        of probed clusters doubles until the candidates hold as large a share
+        of the rows as nprobe clusters hold of the whole index, and at least
+        k of them (all rows without k), or every cluster was probed. Rows
+        fewer than one probe would score are scored exactly instead.
+        """
+        probed_rows = len(self.vectors) * min(self.nprobe, len(self.centroids)) / len(self.centroids)
+        if len(rows) <= probed_rows:
+            # Scoring the rows outright is exact and no more work than probing
+            where = np.empty(len(self.ids), dtype=np.int64)
+            where[self.ids] = np.arange(len(self.ids))
+            scores = np.asarray(self.vectors[where[rows]]) @ normalize(query)[0]
+            return top_candidates(np.arange(len(rows)), scores, k)
+        positions = np.full(len(self.vectors), -1)
+        positions[rows] = np.arange(len(rows))
+        share = int(np.ceil(len(rows) * self.nprobe / len(self.centroids)))
+        wanted = len(rows) if k is None else min(max(k, share), len(rows))
+        nprobe = min(self.nprobe, len(self.centroids))
+        while True:
+            ids, scores = self.search(query, nprobe=nprobe)[0]
+            ids = positions[ids]
+            found = ids >= 0
+            if found.sum() >= wanted or nprobe >= len(self.centroids):
+                return top_candidates(ids[found], scores[found], k)
+            nprobe = min(2 * nprobe, len(self.centroids))
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "vectors", "ids", "offsets"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        _write_meta(path, {"kind": self.kind, "nprobe": self.nprobe})
+
+    @classmethod
+    def load(cls, path, meta, mmap=True):
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in ("centroids", "vectors", "ids", "offsets")
+        }
+        # Centroids and offsets are small and read on every query
+        return cls(np.array(arrays["centroids"]), arrays["vectors"], arrays["ids"], np.array(arrays["offsets"]), nprobe=meta["nprobe"])
+
+BACKENDS = {ExactIndex.kind: ExactIndex, IVFIndex.kind: IVFIndex}
+
+def _nearest(vectors, centroids, chunk_size=65536):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignment
+
+def _write_meta(path, meta):
+    with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def build_index(embeddings, backend="exact", **options):
+    if backend == ExactIndex.kind:
+        return ExactIndex(embeddings)
+    if backend == IVFIndex.kind:
+        return IVFIndex.build(embeddings, **options)
+    raise ValueError(f"Unknown vector index backend: {backend}")
+
+def load_index(path, mmap=True):
+    """Loads an index saved with .save(), memory-mapping its arrays by default."""
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return BACKENDS[meta["kind"]].load(path, meta, mmap=mmap)